@@ -0,0 +1,58 @@
+# files written so that a crash leaves the previous version or the complete new one, never a part of it:
+# the content goes to a temporary file next to the target, is forced to the disk and renamed over the target
+
+import contextlib
+import os
+
+# suffix of the temporary files, left behind only by a crash
+TEMP_SUFFIX = ".tmp"
+
+def fsync_directory(path):
+    # a rename reaches the disk with its directory. Windows has no directory handles, NTFS journals the rename itself
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def replace(temp, path, fsync=True):
+    """
+    Renames a finished temporary file over path
+    @params:
+        temp        - Required  : complete, closed file (Str)
+        path        - Required  : target, replaced if it exists (Str)
+        fsync       - Optional  : force the content and the rename to the disk (Bool)
+    """
+    if fsync:
+        with open(temp, "rb+") as f:
+            os.fsync(f.fileno())
+    os.replace(temp, path)
+    if fsync:
+        fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+@contextlib.contextmanager
+def writer(path, mode="w", fsync=True, **kwargs):
+    """
+    open() for writing path atomically: the file is only replaced when the block completes without an exception
+    @params:
+        path        - Required  : target file (Str)
+        mode        - Optional  : "w" or "wb" (Str)
+        fsync       - Optional  : force the content and the rename to the disk (Bool)
+        kwargs      - Optional  : passed to open(), e.g. encoding
+    """
+    temp = path + TEMP_SUFFIX
+    try:
+        with open(temp, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(temp, path)
+        if fsync:
+            fsync_directory(os.path.dirname(os.path.abspath(path)))
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp)
+        raise
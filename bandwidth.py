@@ -0,0 +1,83 @@
+# global download bandwidth limit shared by all transfers, with an optional time of day schedule
+
+import threading
+import time
+
+from datetime import datetime
+
+from retry import TokenBucket
+
+def parse_schedule(text):
+    """
+    "08:00-18:00=1024, 22:00-06:00=0" -> [(480, 1080, 1048576), (1320, 360, 0)]
+    windows of minutes of the day with their limit in bytes per second (KB/s in the text), 0 = unlimited.
+    a window may go past midnight, the first matching one wins
+    """
+    windows = []
+    for part in (text or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            span, rate = part.split("=")
+            start, end = span.strip().split("-")
+            windows.append((_minutes(start), _minutes(end), int(float(rate) * 1024)))
+        except ValueError:
+            raise ValueError(f"bandwidth schedule entry not understood: '{part}' (expected HH:MM-HH:MM=KB/s)")
+    return windows
+
+def _minutes(hhmm):
+    hours, minutes = hhmm.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+class BandwidthLimiter:
+    """
+    Token bucket of bytes shared by every download: each transfer calls throttle() with the bytes it received
+    and is slowed down as needed, so together they stay under the limit of the moment
+    @params:
+        limit       - Optional  : bytes per second outside the schedule windows, 0 = unlimited (Int)
+        schedule    - Optional  : result of parse_schedule() (List)
+    """
+
+    def __init__(self, limit=0, schedule=None):
+        self.limit = int(limit)
+        self.schedule = schedule or []
+        self._bucket = TokenBucket(0)
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._rate = None
+
+    def rate_at(self, when):
+        # limit in bytes per second at datetime when, 0 = unlimited
+        minute = when.hour * 60 + when.minute
+        for start, end, rate in self.schedule:
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return rate
+        return self.limit
+
+    def current_rate(self):
+        # the schedule is looked at every few seconds, the bucket follows it
+        now = time.monotonic()
+        with self._lock:
+            if self._rate is None or now - self._checked >= 5:
+                self._checked = now
+                rate = self.rate_at(datetime.now())
+                if rate != self._rate:
+                    # a quarter of a second worth of burst keeps the transfers smooth
+                    self._bucket.set_rate(rate, max(rate / 4, 16384))
+                    self._rate = rate
+            return self._rate
+
+    def active(self):
+        return self.limit > 0 or any(rate > 0 for start, end, rate in self.schedule)
+
+    def chunk_size(self, chunk_size):
+        # smaller reads under a low limit, so the transfer slows down evenly instead of in bursts
+        rate = self.current_rate()
+        if rate <= 0:
+            return chunk_size
+        return max(16384, min(chunk_size, int(rate / 8)))
+
+    def throttle(self, nbytes):
+        if self.current_rate() > 0:
+            self._bucket.take(nbytes)
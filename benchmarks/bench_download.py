@@ -0,0 +1,77 @@
+"""
+Download benchmark: MB/s of dltool.download_a_file against a local HTTP server, for several chunk sizes
+
+    python benchmarks/bench_download.py [--size-mb 256] [--repeats 3]
+"""
+
+import argparse
+import contextlib
+import functools
+import http.server
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dltool
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def copyfile(self, source, outputfile):
+        # the server should not be what is measured
+        shutil.copyfileobj(source, outputfile, 1024 * 1024)
+
+def make_file(path, size):
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(size // len(block)):
+            f.write(block)
+
+def timed_download(url, target, repeats, **options):
+    session = requests.Session()
+    best = None
+    for _ in range(repeats):
+        if os.path.exists(target):
+            os.remove(target)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            dltool.download_a_file(url, filename=target, session=session, rename_old=False, skip_if_identical=False, showprogress=False, **options)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as served, tempfile.TemporaryDirectory() as downloads:
+        make_file(os.path.join(served, "file.bin"), args.size_mb * 1024 * 1024)
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=served))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/file.bin".format(server.server_address[1])
+        target = os.path.join(downloads, "file.bin")
+
+        cases = [("8 KB chunks, unbuffered, no preallocation (before)", dict(chunk_size=8192, buffer_size=0, preallocate=False))]
+        for kb in (64, 256, 1024, 4096):
+            cases.append((f"{kb} KB chunks, 1 MB buffer, preallocated", dict(chunk_size=kb * 1024, buffer_size=1024 * 1024)))
+        cases.append(("1024 KB chunks, 1 MB buffer, preallocated, fsync", dict(chunk_size=1024 * 1024, buffer_size=1024 * 1024, fsync=True)))
+
+        print(f"{args.size_mb} MB file, best of {args.repeats}")
+        print(f"{'write path':<52} {'seconds':>8} {'MB/s':>8}")
+        for label, options in cases:
+            seconds = timed_download(url, target, args.repeats, **options)
+            print(f"{label:<52} {seconds:>8.2f} {args.size_mb / seconds:>8.1f}")
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
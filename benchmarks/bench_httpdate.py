@@ -0,0 +1,80 @@
+"""
+Date parsing benchmark: dateparser.parse against httpdate on Last-Modified headers as a sync reads them
+(every upload's date several times: HEAD, skip check, timestamp, file name), mostly IMF-fixdate with a few
+RFC 850 and asctime dates. Checks that both give the same timestamps
+
+    python benchmarks/bench_httpdate.py [--uploads 500] [--reads 4]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+import dateparser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import httpdate
+
+def corpus(uploads, reads, seed=1):
+    # one Last-Modified date per upload, read reads times in the order of a sync
+    rng = random.Random(seed)
+    values = []
+    for _ in range(uploads):
+        when = datetime.fromtimestamp(rng.randint(1262304000, 1767225600), timezone.utc)
+        kind = rng.random()
+        if kind < 0.96:
+            value = format_datetime(when, usegmt=True)
+        elif kind < 0.98:
+            value = when.strftime("%A, %d-%b-%y %H:%M:%S GMT")
+        else:
+            value = "{:%a %b} {:>2} {:%H:%M:%S %Y}".format(when, when.day, when)
+        values.extend([value] * reads)
+    return values
+
+def timed(fn, values):
+    starttime = time.perf_counter()
+    results = [fn(value) for value in values]
+    return time.perf_counter() - starttime, results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=500)
+    parser.add_argument("--reads", type=int, default=4, help="times the date of an upload is parsed in a sync")
+    args = parser.parse_args()
+
+    values = corpus(args.uploads, args.reads)
+    # the first dateparser call loads its language data, it is not part of the comparison
+    dateparser.parse(values[0])
+
+    def with_dateparser(value):
+        parsed = dateparser.parse(value)
+        # asctime dates have no zone, HTTP says they are UTC
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+    def uncached(value):
+        httpdate.parse.cache_clear()
+        return httpdate.timestamp(value)
+
+    httpdate.parse.cache_clear()
+    results = {}
+    baseline = None
+    print(f"{len(values)} headers, {args.uploads} distinct dates")
+    print(f"{'parser':<22} {'seconds':>9} {'us/header':>10} {'speedup':>8}")
+    for label, fn in (("dateparser", with_dateparser), ("httpdate, no cache", uncached), ("httpdate", httpdate.timestamp)):
+        seconds, results[label] = timed(fn, values)
+        baseline = baseline or seconds
+        print(f"{label:<22} {seconds:>9.3f} {seconds / len(values) * 1e6:>10.1f} {baseline / seconds:>8.1f}x")
+
+    mismatches = sum(1 for a, b in zip(results["dateparser"], results["httpdate"]) if a != b)
+    print(f"{mismatches} timestamps differ from dateparser")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Parsing benchmark: full html.parser trees (as the downloader used to do) against pageparse
+on the saved pages in benchmarks/fixtures
+
+    python benchmarks/bench_parse.py [repeats]
+"""
+
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pageparse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+# the downloader before pageparse
+def full_item_page(html):
+    soup = BeautifulSoup(html, "html.parser")
+    token = soup.find("meta", attrs={"name": "csrf_token"})["value"]
+    uploads = soup.find("div", class_="upload_list_widget").find_all(class_="upload")
+    banner = soup.find("a", class_="button", href=lambda h: h and "/download/" in h)
+    return token, uploads, banner
+
+def full_purchases_page(html):
+    items = [(game.find("a", class_="title game_link").text, game.find("a", class_="button")["href"])
+             for game in BeautifulSoup(html, "html.parser").find_all("div", class_="game_cell_data")]
+    nextpage = BeautifulSoup(html, "html.parser").find("div", attrs={"class": "next_page forward_link"})
+    return items, nextpage
+
+def full_iframes(html):
+    return [iframe.get("src") for iframe in BeautifulSoup(html, features="html.parser").find_all("iframe")]
+
+def timed(fn, html, repeats):
+    fn(html)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(html)
+    return (time.perf_counter() - start) / repeats * 1000
+
+def with_parser(fn, parser):
+    def run(html):
+        saved = pageparse.PARSER
+        pageparse.PARSER = parser
+        try:
+            return fn(html)
+        finally:
+            pageparse.PARSER = saved
+    return run
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    cases = [
+        ("item page", "item_page.html", full_item_page, pageparse.parse_item_page),
+        ("my-purchases page", "purchases_page.html", full_purchases_page, pageparse.parse_purchases_page),
+        ("product page iframes", "product_page.html", full_iframes, pageparse.parse_iframes),
+    ]
+
+    # the results have to be the same before comparing the times
+    item = read_fixture("item_page.html")
+    record = pageparse.parse_item_page(item)
+    token, uploads, banner = full_item_page(item)
+    assert record["csrf_token"] == token and len(record["uploads"]) == len(uploads)
+    assert record["download_links"][0] == banner["href"]
+
+    print(f"parser backend: {pageparse.PARSER}, {repeats} repeats")
+    print(f"{'page':<22} {'size KB':>8} {'full ms':>9} {'strained ms':>12} {'backend ms':>11} {'speedup':>8}")
+    for label, fixture, full, targeted in cases:
+        html = read_fixture(fixture)
+        full_ms = timed(full, html, repeats)
+        strained_ms = timed(with_parser(targeted, "html.parser"), html, repeats)
+        backend_ms = timed(targeted, html, repeats)
+        print(f"{label:<22} {len(html) / 1024:>8.0f} {full_ms:>9.2f} {strained_ms:>12.2f} {backend_ms:>11.2f} {full_ms / backend_ms:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
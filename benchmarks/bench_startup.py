@@ -0,0 +1,69 @@
+"""
+Startup benchmark: time to import itch-batch-downloader.py (all of its modules, before main() runs), measured with
+python -X importtime in a fresh interpreter. The capture and video dependencies must not be among the imports,
+they are loaded by the features that use them. Exits with 1 if one of them is, or if the import takes longer than --max-ms
+
+    python benchmarks/bench_startup.py [--repeats 5] [--top 15] [--max-ms 0]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# loaded only when a page is captured, a video or a file is downloaded
+LAZY = ("selenium", "webdriver_manager", "yt_dlp", "PIL", "dateparser", "util")
+
+# the script name has dashes, it is loaded as a module
+LOAD = ("import importlib.util, sys; sys.path.insert(0, {root!r}); "
+        "spec = importlib.util.spec_from_file_location('itch_batch_downloader', {script!r}); "
+        "spec.loader.exec_module(importlib.util.module_from_spec(spec))")
+
+def import_times():
+    # (module, self us, cumulative us, depth) of every import of a fresh interpreter loading the script
+    code = LOAD.format(root=ROOT, script=os.path.join(ROOT, "itch-batch-downloader.py"))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(own), int(cumulative), depth))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest top level imports shown")
+    parser.add_argument("--max-ms", type=float, default=0, help="fail when the fastest import takes longer, 0 = no limit")
+    args = parser.parse_args()
+
+    # the first run fills the bytecode cache, the fastest of the following ones is reported
+    import_times()
+    runs = [import_times() for _ in range(max(1, args.repeats))]
+    best = min(runs, key=lambda rows: sum(row[1] for row in rows))
+    total = sum(row[1] for row in best) / 1000
+
+    toplevel = sorted((row for row in best if row[3] == 0), key=lambda row: row[2], reverse=True)
+    print(f"{'module':<40} {'cumulative ms':>14}")
+    for name, own, cumulative, depth in toplevel[:args.top]:
+        print(f"{name:<40} {cumulative / 1000:>14.1f}")
+    print(f"{'total (' + str(len(best)) + ' modules)':<40} {total:>14.1f}")
+
+    failed = False
+    loaded = sorted({row[0].split(".")[0] for row in best if row[0].split(".")[0] in LAZY})
+    if loaded:
+        print("loaded at startup, should be lazy: " + ", ".join(loaded))
+        failed = True
+    if args.max_ms and total > args.max_ms:
+        print(f"startup {total:.1f} ms is over the limit of {args.max_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+End to end benchmark: a full sync of itch-batch-downloader against the local fake itch.io (fakeitch.py),
+reported as items/s and MB/s. A second sync of the same account measures the run where everything is up to date
+
+    python benchmarks/bench_sync.py [--items 40] [--uploads 3] [--size-kb 2048] [--latency-ms 20] [--bandwidth-kbps 0]
+                                    [--error-rate 0] [--drop-rate 0] [--url-ttl 0] [--set parallel_downloads=8 ...] [--verbose]
+"""
+
+import argparse
+import configparser
+import contextlib
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakeitch
+
+def load_downloader():
+    # the script name has dashes, it is loaded as a module
+    spec = importlib.util.spec_from_file_location("itch_batch_downloader", os.path.join(ROOT, "itch-batch-downloader.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_config(downloader, server, directory, overrides):
+    config = configparser.ConfigParser()
+    config["DEFAULT"] = downloader.default_config()
+    cookiefile = os.path.join(directory, "cookies.txt")
+    with open(cookiefile, "w", encoding="utf-8") as f:
+        f.write("# Netscape HTTP Cookie File\n")
+    config["DEFAULT"].update({
+        "download_directory": os.path.join(directory, "Downloads"),
+        "cookie_file": cookiefile,
+        "create_pdf": "OFF",
+        "create_png": "OFF",
+        "download_videos": "OFF",
+        # the fake server is not rate limited, and injected errors should not wait for seconds
+        "requests_per_second_per_host": "0",
+        "retry_backoff_seconds": "0.1",
+        # the second sync looks at every item again
+        "manifest_recheck_hours": "0",
+    })
+    config["DEFAULT"].update(server.config())
+    config["DEFAULT"].update(overrides)
+    return config
+
+def timed_sync(downloader, config, server, verbose):
+    # seconds from the first request to the end of the sync, the pause at the start of main() is left out
+    server.stats.update(requests=0, bytes=0, errors=0, dropped=0, expired=0)
+    server.first_request = None
+    args = downloader.argument_parser().parse_args([])
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        downloader.main(config, args)
+    ended = time.monotonic()
+    return ended - (server.first_request or ended), dict(server.stats)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--uploads", type=int, default=3)
+    parser.add_argument("--size-kb", type=int, default=2048)
+    parser.add_argument("--style", choices=("old", "new", "mixed"), default="mixed")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--bandwidth-kbps", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--drop-rate", type=float, default=0)
+    parser.add_argument("--url-ttl", type=float, default=0, help="seconds the signed mirror urls are valid, retries must fetch a new one")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="itch-batch-downloader.ini setting")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the syncs")
+    args = parser.parse_args()
+
+    overrides = dict(item.split("=", 1) for item in args.set)
+    catalog = fakeitch.Catalog(args.items, args.uploads, args.size_kb * 1024, args.style)
+    server = fakeitch.FakeItchServer(catalog, 0, args.latency_ms / 1000, args.bandwidth_kbps * 1024, args.error_rate, args.drop_rate, args.url_ttl).start()
+    downloader = load_downloader()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = make_config(downloader, server, directory, overrides)
+        downloader.config = config
+        totalmb = args.items * args.uploads * args.size_kb / 1024
+
+        print(f"{args.items} items x {args.uploads} uploads of {args.size_kb} KB ({round(totalmb, 1)} MB), "
+              f"latency {args.latency_ms} ms, error rate {args.error_rate}, drop rate {args.drop_rate}")
+        if overrides:
+            print("settings: " + ", ".join(f"{key}={value}" for key, value in overrides.items()))
+        print(f"{'sync':<22} {'seconds':>8} {'items/s':>8} {'MB/s':>8} {'requests':>9} {'errors':>7} {'dropped':>8} {'expired':>8}")
+        for label in ("full sync", "up to date sync"):
+            seconds, stats = timed_sync(downloader, config, server, args.verbose)
+            seconds = max(seconds, 0.001)
+            print(f"{label:<22} {seconds:>8.2f} {args.items / seconds:>8.1f} {stats['bytes'] / 1024 / 1024 / seconds:>8.1f} "
+                  f"{stats['requests']:>9} {stats['errors']:>7} {stats['dropped']:>8} {stats['expired']:>8}")
+
+        # every upload must have arrived complete
+        downloads = os.path.join(directory, "Downloads")
+        complete = 0
+        for item in range(args.items):
+            gamedir = os.path.join(downloads, "game-{}".format(item))
+            if os.path.isdir(gamedir):
+                complete = complete + sum(1 for name in os.listdir(gamedir)
+                                          if name.endswith(".zip") and os.path.getsize(os.path.join(gamedir, name)) == catalog.size)
+        print(f"{complete} of {args.items * args.uploads} uploads downloaded completely")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Local stand-in for itch.io and its CDNs, for benchmarks and manual testing without an account
+
+    python benchmarks/fakeitch.py [--items 50] [--uploads 3] [--size-kb 1024] [--latency-ms 0] [--bandwidth-kbps 0] [--error-rate 0]
+                                  [--drop-rate 0] [--url-ttl 0]
+
+Serves on one port:
+    /my-purchases?page=N                    paginated purchase list (game_cell_data cells, next_page link)
+    /game-N/download/KEY                    item download page with csrf token and upload_list_widget
+    POST /game-N/file/ID                    download JSON of the old style uploads (data-upload_id)
+    GET /game-N/download/KEY/upload/ID      download JSON of the new style uploads (href with /download/)
+    /cdn/ID/NAME                            file with Last-Modified, ETag and Content-Disposition (stands in for hwcdn)
+    /mirror/ID/NAME                         the same, on the host that stands in for the Cloudflare mirror: signed for GET
+                                            only (HEAD gets 403) and, with --url-ttl, expired (403) after that many seconds
+Files are generated from the upload id, honour Range requests and can be slowed down or fail on purpose.
+The CDN urls use "localhost" and the mirror urls "127.0.0.1", so the downloader can tell them apart:
+    itch_url = http://127.0.0.1:PORT
+    cdn_hosts = localhost:PORT
+    mirror_hosts = 127.0.0.1:PORT
+"""
+
+import argparse
+import email.utils
+import hashlib
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+PAGE_SIZE = 50
+# every upload has the same date, so a second sync finds the files up to date
+LAST_MODIFIED = email.utils.formatdate(1710237600, usegmt=True)
+
+class Catalog:
+    """
+    The purchases of the fake account
+    @params:
+        items       - Optional  : number of purchased items (Int)
+        uploads     - Optional  : uploads per item (Int)
+        size        - Optional  : bytes per upload (Int)
+        style       - Optional  : "old" (data-upload_id), "new" (/download/ links) or "mixed" (alternating per item) (Str)
+        mirror      - Optional  : share of the uploads served like the Cloudflare mirror, the rest like hwcdn (Float)
+    """
+
+    def __init__(self, items=50, uploads=3, size=1024 * 1024, style="mixed", mirror=0.5):
+        self.items = items
+        self.uploads = uploads
+        self.size = size
+        self.style = style
+        self.mirror = mirror
+
+    def key(self, item):
+        return "KEY{:04d}abcdefghijklmnopqrstuvwxyz0123".format(item)
+
+    def upload_id(self, item, number):
+        return 8400000 + item * 100 + number
+
+    def item_style(self, item):
+        if self.style == "mixed":
+            return "old" if item % 2 == 0 else "new"
+        return self.style
+
+    def upload_name(self, upload_id):
+        return "upload-{}-linux.zip".format(upload_id)
+
+    def uses_mirror(self, upload_id):
+        return (upload_id % 100) < self.uploads * self.mirror
+
+    def content(self, upload_id, start, end):
+        # bytes start..end (inclusive) of an upload, a repeated 64 KB block derived from its id
+        block = hashlib.sha256(str(upload_id).encode()).digest() * 2048
+        first = start % len(block)
+        data = block[first:] + block * ((end - start + 1) // len(block) + 1)
+        return data[:end - start + 1]
+
+def purchases_page(catalog, base, page):
+    cells = []
+    first = (page - 1) * PAGE_SIZE
+    for item in range(first, min(first + PAGE_SIZE, catalog.items)):
+        cells.append(
+            '<div class="game_cell has_cover" data-game_id="{0}"><div class="game_cell_data">'
+            '<div class="game_title"><a class="title game_link" href="{1}/game-{0}">Game number {0}</a></div>'
+            '<div class="game_author"><a href="{1}">Dev {0}</a></div>'
+            '<a class="button" href="{1}/game-{0}/download/{2}">Download</a></div></div>'.format(item, base, catalog.key(item)))
+    nextpage = ""
+    if first + PAGE_SIZE < catalog.items:
+        nextpage = '<div class="next_page forward_link"><a href="/my-purchases?page={}" class="button">Next page</a></div>'.format(page + 1)
+    return ('<!DOCTYPE html><html><head><title>My purchases</title></head><body><div class="game_grid_widget">{}</div>{}</body></html>'
+            .format("".join(cells), nextpage))
+
+def item_page(catalog, base, item):
+    uploads = []
+    for number in range(catalog.uploads):
+        upload_id = catalog.upload_id(item, number)
+        if catalog.item_style(item) == "old":
+            button = '<a class="button download_btn" data-upload_id="{}" href="#">Download</a>'.format(upload_id)
+        else:
+            button = '<a class="button download_btn" href="{}/game-{}/download/{}/upload/{}">Download</a>'.format(base, item, catalog.key(item), upload_id)
+        uploads.append(
+            '<div class="upload"><div class="info_column"><div class="upload_name">'
+            '<strong class="name" title="{0}">{0}</strong> <span class="file_size"><span>{1} KB</span></span></div></div>'
+            '<div class="download_btn_column">{2}</div></div>'.format(catalog.upload_name(upload_id), catalog.size // 1024, button))
+    return ('<!DOCTYPE html><html><head><meta name="csrf_token" value="fake-csrf-token-{0}"/><title>Download Game number {0}</title></head>'
+            '<body><div class="upload_list_widget base_widget">{1}</div></body></html>'.format(item, "".join(uploads)))
+
+class FakeItchHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request(head=True)
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        length = int(self.headers.get("content-length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.handle_request()
+
+    def handle_request(self, head=False):
+        server = self.server
+        server.count("requests")
+        if server.latency:
+            time.sleep(server.latency)
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        base = "http://127.0.0.1:{}".format(server.server_address[1])
+        catalog = server.catalog
+        try:
+            if parts == ["my-purchases"]:
+                page = int(urllib.parse.parse_qs(url.query).get("page", ["1"])[0])
+                return self.send_body(purchases_page(catalog, base, page).encode(), "text/html", head)
+            if len(parts) >= 2 and parts[0].startswith("game-"):
+                item = int(parts[0][5:])
+                if item >= catalog.items:
+                    return self.send_error(404)
+                if self.command == "POST" and len(parts) == 3 and parts[1] == "file":
+                    return self.send_download_json(int(parts[2]))
+                if len(parts) == 5 and parts[1] == "download" and parts[3] == "upload":
+                    return self.send_download_json(int(parts[4]))
+                if len(parts) == 3 and parts[1] == "download":
+                    return self.send_body(item_page(catalog, base, item).encode(), "text/html", head)
+            if len(parts) == 3 and parts[0] == "mirror" and not self.signature_valid(url, head):
+                server.count("expired")
+                return self.send_error(403)
+            if len(parts) == 3 and parts[0] in ("cdn", "mirror"):
+                return self.send_file(int(parts[1]), parts[2], head)
+            self.send_error(404)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_body(self, body, content_type, head=False):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_download_json(self, upload_id):
+        catalog = self.server.catalog
+        name = catalog.upload_name(upload_id)
+        if catalog.uses_mirror(upload_id):
+            url = "http://127.0.0.1:{}/mirror/{}/{}?signature=fake&expires={}".format(
+                self.server.server_address[1], upload_id, name, int(time.time() + self.server.url_ttl) if self.server.url_ttl else 0)
+        else:
+            url = "http://localhost:{}/cdn/{}/{}?token=fake".format(self.server.server_address[1], upload_id, name)
+        self.send_body(json.dumps({"url": url}).encode(), "application/json")
+
+    def signature_valid(self, url, head):
+        # like a presigned GET url of the mirror: no HEAD, and useless once expired
+        expires = int(urllib.parse.parse_qs(url.query).get("expires", ["0"])[0])
+        return not head and (not expires or time.time() < expires)
+
+    def send_file(self, upload_id, name, head=False):
+        server = self.server
+        size = server.catalog.size
+        if not head and server.error_rate and random.random() < server.error_rate:
+            # overloaded CDN, the client is asked to retry
+            server.count("errors")
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start, end = 0, size - 1
+        status = 200
+        rangeheader = self.headers.get("range")
+        ifrange = self.headers.get("if-range")
+        if rangeheader and rangeheader.startswith("bytes=") and (not ifrange or ifrange in (LAST_MODIFIED, self.etag(upload_id))):
+            first, _, last = rangeheader[6:].partition("-")
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.send_header("ETag", self.etag(upload_id))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Disposition", 'attachment; filename="{}"'.format(name))
+        if status == 206:
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+        self.end_headers()
+        if head:
+            return
+        self.stream(upload_id, start, end)
+
+    def etag(self, upload_id):
+        return '"{}"'.format(upload_id)
+
+    def stream(self, upload_id, start, end):
+        # sent in 64 KB blocks, paced to the bandwidth of the connection, maybe cut off halfway
+        server = self.server
+        block = 64 * 1024
+        cut = None
+        if server.drop_rate and random.random() < server.drop_rate:
+            cut = start + (end - start + 1) // 2
+        starttime = time.monotonic()
+        sent = 0
+        position = start
+        while position <= end:
+            last = min(position + block - 1, end)
+            if cut is not None and last >= cut:
+                server.count("dropped")
+                self.close_connection = True
+                return
+            data = server.catalog.content(upload_id, position, last)
+            self.wfile.write(data)
+            sent = sent + len(data)
+            server.count("bytes", len(data))
+            position = last + 1
+            if server.bandwidth:
+                ahead = sent / server.bandwidth - (time.monotonic() - starttime)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+class FakeItchServer(http.server.ThreadingHTTPServer):
+    """
+    The fake itch.io site and CDNs, on 127.0.0.1
+    @params:
+        catalog         - Required  : Catalog of the account
+        port            - Optional  : 0 = any free port (Int)
+        latency         - Optional  : seconds added to every request (Float)
+        bandwidth       - Optional  : bytes per second of each file transfer, 0 = unlimited (Int)
+        error_rate      - Optional  : share of the file requests answered with 503 and Retry-After (Float)
+        drop_rate       - Optional  : share of the file transfers cut off halfway (Float)
+        url_ttl         - Optional  : seconds the signed mirror urls are valid, 0 = forever (Float)
+    """
+
+    daemon_threads = True
+
+    def __init__(self, catalog, port=0, latency=0.0, bandwidth=0, error_rate=0.0, drop_rate=0.0, url_ttl=0.0):
+        super().__init__(("127.0.0.1", port), FakeItchHandler)
+        self.catalog = catalog
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.url_ttl = url_ttl
+        self.stats = {"requests": 0, "bytes": 0, "errors": 0, "dropped": 0, "expired": 0}
+        # time.monotonic() of the first request, for timing a sync
+        self.first_request = None
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] = self.stats[name] + amount
+            if name == "requests" and self.first_request is None:
+                self.first_request = time.monotonic()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def config(self):
+        # settings pointing itch-batch-downloader to this server
+        port = self.server_address[1]
+        return {
+            "itch_url": "http://127.0.0.1:{}".format(port),
+            "cdn_hosts": "localhost:{}".format(port),
+            "mirror_hosts": "127.0.0.1:{}".format(port),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="fake itch.io for local testing")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--uploads", type=int, default=3)
+    parser.add_argument("--size-kb", type=int, default=1024)
+    parser.add_argument("--style", choices=("old", "new", "mixed"), default="mixed")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--bandwidth-kbps", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--drop-rate", type=float, default=0)
+    parser.add_argument("--url-ttl", type=float, default=0, help="seconds the signed mirror urls are valid, 0 = forever")
+    args = parser.parse_args()
+
+    catalog = Catalog(args.items, args.uploads, args.size_kb * 1024, args.style)
+    server = FakeItchServer(catalog, args.port, args.latency_ms / 1000, args.bandwidth_kbps * 1024, args.error_rate, args.drop_rate, args.url_ttl)
+    print("Fake itch.io on http://127.0.0.1:{}, settings for itch-batch-downloader.ini:".format(server.server_address[1]))
+    for key, value in server.config().items():
+        print("{} = {}".format(key, value))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# pool of long lived headless chrome browsers, reused for the product page captures of many items
+
+import queue
+import threading
+
+import events
+import profiling
+
+class BrowserPool:
+    """
+    Headless chrome browsers started on demand and reused across items
+    @params:
+        size            - Optional  : maximum number of browsers running at the same time (Int)
+        recycle_after   - Optional  : pages loaded by a browser before it is restarted, 0 = never (Int)
+        debugon         - Optional  : debug output (Bool)
+    """
+
+    def __init__(self, size=1, recycle_after=50, debugon=False):
+        self.size = max(1, int(size))
+        self.recycle_after = int(recycle_after)
+        self.debugon = debugon
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._uses = {}
+        self._window_sizes = {}
+        self._driver_path = None
+
+    def driver_path(self):
+        # chromedriver is looked up (and downloaded if needed) once per run
+        from webdriver_manager.chrome import ChromeDriverManager
+
+        with self._lock:
+            if self._driver_path is None:
+                self._driver_path = ChromeDriverManager().install()
+            return self._driver_path
+
+    def _start(self):
+        # selenium 4, imported on the first browser start: runs without captures never load it
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service as ChromeService
+        from selenium.webdriver.chrome.options import Options
+
+        options = Options()
+        options.add_experimental_option('excludeSwitches', ['enable-logging'])
+        options.add_argument('--headless')
+        options.add_argument('--disable-gpu')
+        options.add_argument("--disable-3d-apis")
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        options.add_argument('--hide-scrollbars')
+        options.add_argument('--disable-web-security')
+
+        with profiling.stage("chrome_start"):
+            driver = webdriver.Chrome(service=ChromeService(self.driver_path()), options=options)
+        self._uses[id(driver)] = 0
+        self._window_sizes[id(driver)] = driver.get_window_size()
+        if self.debugon:
+            events.debug("Browser started")
+        return driver
+
+    def acquire(self):
+        # an idle browser, a new one if the pool is not full yet, otherwise waits for one to be released
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                start = self._started < self.size
+                if start:
+                    self._started = self._started + 1
+            if start:
+                try:
+                    return self._start()
+                except BaseException:
+                    with self._lock:
+                        self._started = self._started - 1
+                    raise
+            # a browser discarded in the meantime frees a place in the pool, so the wait is not endless
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                pass
+
+    def release(self, driver):
+        # browsers that crashed or loaded recycle_after pages are closed, the next acquire() starts a new one
+        self._uses[id(driver)] = self._uses.get(id(driver), 0) + 1
+        if self.recycle_after > 0 and self._uses[id(driver)] >= self.recycle_after:
+            if self.debugon:
+                events.debug("Browser recycled after {} pages".format(self._uses[id(driver)]))
+            self.discard(driver)
+            return
+        try:
+            size = self._window_sizes.get(id(driver))
+            if size:
+                # captures resize the window to the page, the next page starts from the original size
+                driver.set_window_size(size["width"], size["height"])
+            driver.get("about:blank")
+        except Exception:
+            events.warning("Browser not responding, starting a new one")
+            self.discard(driver)
+            return
+        self._idle.put(driver)
+
+    def discard(self, driver):
+        self._uses.pop(id(driver), None)
+        self._window_sizes.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self._started = self._started - 1
+
+    def close(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(driver)
@@ -0,0 +1,129 @@
+# content addressed store: identical files are kept once and linked into every game directory
+
+import os
+import shutil
+import threading
+
+import events
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# linux ioctl cloning a file (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+def reflink(source, target):
+    # copy on write clone of source, raises OSError where the filesystem does not support it
+    if fcntl is None:
+        raise OSError("reflink not supported on this system")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def link_file(source, target, hardlink=True, copy=True):
+    """
+    Puts the content of source at target, sharing the disk space when the filesystem allows it
+    @params:
+        source      - Required  : existing file (Str)
+        target      - Required  : path to create, replaced if it exists (Str)
+        hardlink    - Optional  : a hard link is allowed, false if target needs its own metadata (Bool)
+        copy        - Optional  : copy the file if it cannot be linked, raise OSError otherwise (Bool)
+    returns "hardlink", "reflink" or "copy"
+    """
+    temp = target + ".dedup"
+    if os.path.exists(temp):
+        os.remove(temp)
+    method = None
+    if hardlink:
+        try:
+            os.link(source, temp)
+            method = "hardlink"
+        except OSError:
+            pass
+    if method is None:
+        try:
+            reflink(source, temp)
+            method = "reflink"
+        except OSError:
+            if os.path.exists(temp):
+                os.remove(temp)
+            if not copy:
+                raise
+            shutil.copyfile(source, temp)
+            method = "copy"
+    os.replace(temp, target)
+    return method
+
+class DedupStore:
+    """
+    Files of the download directory indexed by size and SHA-256 in the manifest, with one hard link per
+    content in the store directory so the content stays around when the game directories change
+    @params:
+        directory   - Required  : store directory, on the same filesystem as the downloads (Str)
+        manifest    - Required  : manifest.Manifest keeping the index
+        debugon     - Optional  : debug output (Bool)
+    """
+
+    def __init__(self, directory, manifest, debugon=False):
+        self.directory = directory
+        self.manifest = manifest
+        self.debugon = debugon
+        self._lock = threading.Lock()
+
+    def _object_path(self, sha256):
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    def find(self, sha256, size):
+        # path of a file with this content, None if it is not known (anymore)
+        row = self.manifest.content(sha256, size)
+        if row is not None and os.path.isfile(row["local_path"]) and os.path.getsize(row["local_path"]) == size:
+            return row["local_path"]
+        return None
+
+    def known_upload(self, upload_id, size, last_modified):
+        # file with the content of an upload downloaded before, maybe for another item of a bundle,
+        # returns (path, sha256, fast hash), path is None if there is none
+        sha256, fast_hash = self.manifest.upload_hashes(upload_id, size, last_modified)
+        if sha256 is None:
+            return None, None, None
+        return self.find(sha256, size), sha256, fast_hash
+
+    def link(self, source, target, mtime=None):
+        # a hard link shares the modification time, so it is only used when the times already match
+        hardlink = mtime is None or int(os.stat(source).st_mtime) == int(mtime)
+        return link_file(source, target, hardlink=hardlink)
+
+    def add(self, path, sha256, size):
+        """
+        Indexes a downloaded file, or replaces it with a link to the same content stored earlier
+        returns the method used to replace the file ("hardlink" or "reflink"), None if the file was kept
+        """
+        with self._lock:
+            existing = self.find(sha256, size)
+            if existing is not None and os.path.exists(path) and os.path.samefile(existing, path):
+                return None
+            if existing is None:
+                # the store keeps a hard link of the first copy, a copy would not save anything
+                storepath = self._object_path(sha256)
+                os.makedirs(os.path.dirname(storepath), exist_ok=True)
+                try:
+                    if os.path.exists(storepath):
+                        os.remove(storepath)
+                    os.link(path, storepath)
+                except OSError:
+                    storepath = path
+                self.manifest.record_content(sha256, size, storepath)
+                return None
+            mtime = os.stat(path).st_mtime
+            hardlink = int(os.stat(existing).st_mtime) == int(mtime)
+            try:
+                # a copy would not save anything, the downloaded file is kept then
+                method = link_file(existing, path, hardlink=hardlink, copy=False)
+            except OSError:
+                return None
+            if method != "hardlink":
+                os.utime(path, (mtime, mtime))
+            if self.debugon:
+                events.debug(f"Duplicate of {existing}, replaced by a {method}: {path}")
+            return method
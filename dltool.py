@@ -1,87 +1,423 @@
 # download pretty a file
 
+import contextlib
+import json
 import os
+import hashlib
+import itertools
 import shutil
+import sys
+import threading
 import time
 
-import dateparser
 import requests
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
-# Print iterations progress
-def printProgressBar(iteration, total, prefix='', suffix='', usepercent=True, decimals=1, fill='X', debugon=False):
+import atomicfile
+import events
+import httpdate
+import profiling
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+class ProgressDisplay:
     """
-    Call in a loop to create terminal progress bar
+    Status of the running downloads, one line per file plus the total throughput when there are several.
+    Redrawn at most rate times per second, and only if stdout is a terminal
     @params:
-        iteration   - Required  : current iteration (Int)
-        total       - Required  : total iterations (Int)
-        prefix      - Optional  : prefix string (Str)
-        suffix      - Optional  : suffix string (Str)
-        usepercent  - Optoinal  : display percentage (Bool)
-        decimals    - Optional  : positive number of decimals in percent complete (Int), ignored if usepercent = False
-        length      - Optional  : character length of bar (Int)
-        fill        - Optional  : bar fill character (Str)
+        rate        - Optional  : redraws per second (Float)
+        enabled     - Optional  : draw the status at all, by default only on a terminal (Bool)
     """
 
-    prefix = datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] " + prefix
+    def __init__(self, rate=8, enabled=None):
+        self.interval = 1.0 / rate
+        self.enabled = sys.stdout.isatty() if enabled is None else enabled
+        self._lock = threading.RLock()
+        self._ids = itertools.count()
+        self._transfers = {}
+        self._stream = None
+        self._drawn = 0
+        self._linestart = True
+        self._next = 0
 
-    # length is calculated by terminal width
-    twx, twy = shutil.get_terminal_size()
-    length = twx - 1 - len(prefix) - len(suffix) -4
-    if usepercent:
-        length = length - 6
-    if total == 0:
-        filledLength = int(length * iteration // 1)
-    else:
-        filledLength = int(length * iteration // total)
-    bar = fill * filledLength + '-' * (length - filledLength)
-    
-     # process percent
-    if usepercent:
-        if total == 0:
-            percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(1)))
-        else:
-            percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
-        print('\r%s |%s| %s%% %s' % (prefix, bar, percent, suffix), end='', flush=True)
+    def start(self, name, total, done=0):
+        # returns the key passed to update() and finish()
+        key = next(self._ids)
+        with self._lock:
+            self._transfers[key] = {"name": name, "total": total, "done": done, "resumed": done, "started": time.monotonic()}
+            if self.enabled and self._stream is None:
+                # log lines printed meanwhile go above the status
+                self._stream = sys.stdout
+                sys.stdout = _StatusConsole(self, self._stream)
+        self.update(key, done, force=True)
+        return key
+
+    def update(self, key, done, force=False):
+        # cheap enough for every chunk, the status is drawn only when interval has passed
+        transfer = self._transfers.get(key)
+        if transfer is None:
+            return
+        transfer["done"] = done
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if not force and now < self._next:
+            return
+        with self._lock:
+            self._next = now + self.interval
+            self._draw(now)
+
+    def finish(self, key):
+        with self._lock:
+            self._transfers.pop(key, None)
+            if self._stream is None:
+                return
+            self._draw(time.monotonic())
+            if not self._transfers:
+                sys.stdout = self._stream
+                self._stream = None
+
+    def _erase(self):
+        if self._drawn:
+            self._stream.write("\x1b[{}A\r\x1b[J".format(self._drawn))
+            self._drawn = 0
+
+    def _draw(self, now):
+        if self._stream is None:
+            return
+        width = shutil.get_terminal_size()[0] - 1
+        lines = []
+        totalspeed = 0
+        for transfer in list(self._transfers.values()):
+            speed = (transfer["done"] - transfer["resumed"]) / max(now - transfer["started"], 0.001)
+            totalspeed = totalspeed + speed
+            if transfer["total"]:
+                percent = "{0:5.1f}%".format(100 * transfer["done"] / transfer["total"])
+            else:
+                percent = "     ?"
+            line = f"{percent} {round(transfer['done']/1024/1024,1)}/{round(transfer['total']/1024/1024,1)} MB ({round(speed/1024,1)} KB/s) {transfer['name']}"
+            lines.append(line[:width])
+        if len(lines) > 1:
+            lines.append(f"{len(lines)} downloads, {round(totalspeed/1024/1024,2)} MB/s in total"[:width])
+        self._erase()
+        if lines:
+            self._stream.write(("" if self._linestart else "\n") + "\n".join(lines) + "\n")
+            self._linestart = True
+        self._stream.flush()
+        self._drawn = len(lines)
+
+class _StatusConsole:
+    # stdout while downloads are shown: the status lines are removed before anything else is written
+    def __init__(self, display, stream):
+        self._display = display
+        self._stream = stream
+
+    def write(self, text):
+        with self._display._lock:
+            self._display._erase()
+            if text:
+                self._display._linestart = text.endswith("\n")
+            return self._stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+# shared by all the downloads of the process
+display = ProgressDisplay()
+
+def validator_of(headers):
+    # strong ETag if the server sends one, Last-Modified otherwise
+    etag = headers.get("etag", "")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("last-modified", "")
+
+def write_resume_info(incompletefilename, headers, datalength, written=None):
+    # sidecar of the .incomplete file with the remote version it belongs to.
+    # written is set for a preallocated file, whose size says nothing about the bytes downloaded
+    info = {
+        "etag": headers.get("etag", ""),
+        "last-modified": headers.get("last-modified", ""),
+        "content-length": datalength,
+    }
+    if written is not None:
+        info["written"] = written
+    with atomicfile.writer(incompletefilename + ".json", "w", encoding="utf-8") as f:
+        json.dump(info, f)
+
+def read_resume_info(incompletefilename):
+    try:
+        with open(incompletefilename + ".json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def remove_resume_info(incompletefilename):
+    if os.path.exists(incompletefilename + ".json"):
+        os.remove(incompletefilename + ".json")
+
+def resumable_size(incompletefilename, headers):
+    # returns the number of bytes of the .incomplete file that can be kept, 0 to start from scratch
+    if not os.path.isfile(incompletefilename) or not os.path.isfile(incompletefilename + ".json"):
+        return 0
+    if headers.get("accept-ranges", "").lower() != "bytes" or not validator_of(headers):
+        return 0
+    info = read_resume_info(incompletefilename)
+    if info is None or "ranges" in info:
+        # a preallocated file of the segmented mode cannot be continued byte by byte
+        return 0
+
+    # the remote file must still be the one the .incomplete file was started with
+    if headers.get("etag") and info.get("etag") and headers.get("etag") != info.get("etag"):
+        return 0
+    if headers.get("last-modified") and info.get("last-modified") != headers.get("last-modified"):
+        return 0
+
+    size = min(info.get("written", os.path.getsize(incompletefilename)), os.path.getsize(incompletefilename))
+    if not info.get("content-length") or size >= info["content-length"]:
+        return 0
+    return size
+
+def fast_hasher(name):
+    # the optional second hash, cheaper to verify than sha256: "xxh3" (needs the xxhash package) or "blake2b"
+    if name == "xxh3" and xxhash is not None:
+        return xxhash.xxh3_128()
+    if name == "blake2b":
+        return hashlib.blake2b()
+    return None
+
+def hash_digest(name, hasher):
+    # "name:hexdigest" as stored in the manifest
+    return f"{name}:{hasher.hexdigest()}"
+
+def hash_file(path, length=None, hashers=None, blocksize=8 * 1024 * 1024):
+    # hashers (sha256 by default) updated with the first length bytes of path, the whole file if length is None
+    if hashers is None:
+        hashers = [hashlib.sha256()]
+    remaining = length
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            block = f.read(blocksize if remaining is None else min(blocksize, remaining))
+            if not block:
+                break
+            for hasher in hashers:
+                hasher.update(block)
+            if remaining is not None:
+                remaining = remaining - len(block)
+    return hashers
+
+def preallocate_file(f, size):
+    # reserves the disk space up front where the system supports it, a sparse file of the right size otherwise
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except (AttributeError, OSError):
+        f.truncate(size)
+
+def raise_for_answer(response, what):
+    # an error answer fails the download, so the item goes to the retry pass instead of passing for "nothing new".
+    # 4xx/5xx raise HTTPError (a 429/5xx the session gave up on is not tried again), anything else IOError
+    response.close()
+    response.raise_for_status()
+    raise IOError(f"{what} failed ({response.status_code})")
+
+def enough_disk_space(path, needed):
+    # prints an error and returns false if the filesystem of path has less than needed bytes free
+    try:
+        free = shutil.disk_usage(os.path.dirname(os.path.abspath(path))).free
+    except OSError:
+        return True
+    if free >= needed:
+        return True
+    events.error(f"Not enough disk space for {path}: {round(needed/1024/1024,1)} MB needed, {round(free/1024/1024,1)} MB free")
+    return False
+
+def content_range_matches(headers, resume_from, head_headers):
+    # "Content-Range: bytes 1000-1999/2000" has to start where the .incomplete file ends
+    try:
+        unit, spec = headers["content-range"].split(" ", 1)
+        start = int(spec.split("-", 1)[0])
+        total = spec.split("/", 1)[1]
+    except (KeyError, ValueError, IndexError):
+        return False
+    if unit != "bytes" or start != resume_from:
+        return False
+    expected = head_headers.get("content-length")
+    return total == "*" or not expected or total == expected
+
+def rename_old_file(final_path):
+    # keeps the previous version of a file around as <name>_<timestamp>.old
+    if not os.path.exists(final_path):
+        return
+    now = datetime.now()
+    ts = now.strftime("%Y%m%d%H%M%S")
+    old_name = f"{final_path}_{ts}.old"
+    events.info(f"Renaming {final_path} → {old_name}")
+    if os.path.exists(old_name):
+        os.remove(old_name)
+    os.rename(final_path, old_name)
+
+def remote_filename(url, headers):
+    # file name sent by the server, the last path component of the URL (without query string) if there is none
+    cd = headers.get("content-disposition")
+    if cd and "filename=" in cd:
+        return cd.split("filename=")[-1].strip('";\'')
+    return url.split("/")[-1].split("?")[0]
+
+def use_segments(headers, segments, segment_threshold):
+    # segmented mode needs a known length and a server that accepts byte ranges
+    if segments <= 1 or headers.get("accept-ranges", "").lower() != "bytes":
+        return False
+    try:
+        datalength = int(headers["content-length"])
+    except (KeyError, ValueError):
+        return False
+    return datalength > 0 and datalength >= segment_threshold
+
+def split_ranges(datalength, segments):
+    # a few more ranges than connections, so a slow connection does not hold back the end of the download
+    size = max(-(-datalength // (segments * 4)), 8 * 1024 * 1024)
+    return [(start, min(start + size, datalength) - 1) for start in range(0, datalength, size)]
+
+def download_segmented(dlurl, session, cookies, head_headers, incompletefilename, datalength, segments, final_path, showprogress=True, debugon=False,
+                       chunk_size=1048576, buffer_size=1048576, fsync=False, limiter=None, connections=None):
+    # returns the number of bytes in the .incomplete file, raises if a range could not be downloaded
+    # the ranges are split for segments connections, so an interrupted download is continued with the same ranges,
+    # connections (default segments) is how many of them are actually open at the same time
+    ranges = split_ranges(datalength, segments)
+    validator = validator_of(head_headers)
+
+    # ranges finished by an earlier, interrupted try are kept
+    done = set()
+    info = read_resume_info(incompletefilename)
+    if (info is not None and "ranges" in info and validator and info.get("validator") == validator
+            and info.get("content-length") == datalength and os.path.isfile(incompletefilename)
+            and os.path.getsize(incompletefilename) == datalength):
+        done = set(tuple(r) for r in info["ranges"]) & set(ranges)
     else:
-        print('\r%s |%s| %s' % (prefix, bar, suffix), end='', flush=True)
+        with open(incompletefilename, "wb") as f:
+            preallocate_file(f, datalength)
+        done = set()
+    if done:
+        events.info(f"Resuming download of {final_path}, {len(done)} of {len(ranges)} ranges already downloaded")
+
+    lock = threading.Lock()
+    progress = [sum(end - start + 1 for start, end in done)]
 
-    # Print New Line on Complete
-    if iteration == total:
-        print(flush=True)
+    def save_ranges():
+        # replaced atomically, a crash while it is written must not lose the ranges already done
+        with atomicfile.writer(incompletefilename + ".json", "w", encoding="utf-8") as f:
+            json.dump({"validator": validator, "content-length": datalength, "ranges": sorted(done)}, f)
 
-def download_a_file(url, filename="", session=None, cookies=None, rename_old=True, skip_if_identical=True, debugon=False):
+    def fetch_range(start, end):
+        headers = {"Range": f"bytes={start}-{end}"}
+        if validator:
+            headers["If-Range"] = validator
+        r = session.get(dlurl, stream=True, cookies=cookies, headers=headers)
+        try:
+            # an error answer the session gave up on is not tried again by the caller
+            r.raise_for_status()
+            if r.status_code != 206 or not content_range_matches(r.headers, start, head_headers):
+                raise IOError(f"range {start}-{end} not served ({r.status_code}), remote file changed?")
+            written = 0
+            length = end - start + 1
+            with open(incompletefilename, "r+b", buffering=buffer_size) as f:
+                f.seek(start)
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    if not chunk:
+                        continue
+                    # never write past the range, it belongs to another connection
+                    chunk = chunk[:length - written]
+                    if limiter is not None:
+                        limiter.throttle(len(chunk))
+                    f.write(chunk)
+                    written += len(chunk)
+                    with lock:
+                        progress[0] += len(chunk)
+                    if written >= length:
+                        break
+                # a range is only marked done once it is on the disk, whatever fsync says: after a power loss
+                # a range marked done but never written would read back as zeros and pass for downloaded
+                f.flush()
+                os.fsync(f.fileno())
+            if written != length:
+                raise IOError(f"range {start}-{end} incomplete ({written} bytes)")
+        finally:
+            r.close()
+
+    save_ranges()
+    if showprogress:
+        transfer = display.start(os.path.basename(final_path), datalength, progress[0])
+    with ThreadPoolExecutor(max_workers=connections or segments, thread_name_prefix="segment") as executor:
+        futures = {executor.submit(fetch_range, start, end): (start, end) for start, end in ranges if (start, end) not in done}
+        waiting = set(futures)
+        try:
+            while waiting:
+                finished, waiting = wait(waiting, timeout=display.interval, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    with lock:
+                        done.add(futures[future])
+                        save_ranges()
+                if showprogress:
+                    display.update(transfer, progress[0])
+        except BaseException:
+            for future in waiting:
+                future.cancel()
+            raise
+        finally:
+            if showprogress:
+                display.finish(transfer)
+
+    return progress[0]
+
+def download_a_file(url, filename="", session=None, cookies=None, rename_old=True, skip_if_identical=True, debugon=False, showprogress=True, segments=1, segment_threshold=0, info=None,
+                    chunk_size=1048576, buffer_size=1048576, preallocate=True, fsync=False, fsync_interval=0, dedup=None, upload_id=None, fast_hash=None, limiter=None, is_mirror=False, host_slots=None):
     # returns true if the file was downloaded
+    # info (dict) receives path, size and last_modified of the local file, also when the download was skipped
+    # showprogress = False leaves the download out of the status display
+    # files of at least segment_threshold bytes are downloaded over segments connections, if the server supports ranges
+    # chunk_size is read from the connection at a time, buffer_size is the write buffer of the .incomplete file.
+    # preallocate reserves the whole file before writing, fsync flushes it to the disk before it is renamed
+    # (and every fsync_interval bytes, if set)
+    # dedup (dedup.DedupStore) links a known upload_id instead of downloading it again and replaces duplicates by links,
+    # info also receives the sha256 of the file, and fast_hash ("xxh3" or "blake2b") computed along with it
+    # limiter (bandwidth.BandwidthLimiter) is shared by all the transfers, to stay under a global bandwidth limit
+    # is_mirror marks a signed url of the Cloudflare mirror (mirror_hosts): GET only, no reliable metadata, expires quickly
+    # host_slots (scheduler.DownloadScheduler) counts every connection of a segmented download against the per host cap:
+    # the caller holds the slot of the first one, the others only use slots that are free, down to a single connection
     if cookies is None and session is not None:
         cookies = session.cookies
     if session is None:
         session = requests.Session()
 
     dlurl = url  # keep the original string for later use
+    if limiter is not None:
+        chunk_size = limiter.chunk_size(chunk_size)
     newDownloads = 0
 
-    # Detect Cloudflare‑mirrored URLs
-    is_cloudflare = dlurl.startswith("https://itchio-mirror.") or dlurl.startswith("https://r2.cloudflarestorage.com")
+    # Cloudflare‑mirrored URLs, the caller tells them by their host
+    is_cloudflare = is_mirror
 
     if is_cloudflare:
         # Direct GET because of the time constraint
         data = session.get(dlurl, stream=True, cookies=cookies)
+        if data.status_code in (401, 403):
+            # signed url expired, the caller fetches a new one and tries again
+            data.raise_for_status()
     else:
         data = session.head(dlurl)
     if data.status_code != 200:
-        return False
+        raise_for_answer(data, ("GET" if is_cloudflare else "HEAD") + " request")
 
     datadownloaded = 0
 
     # figure out file name
-    raw_name = ""
-    cd = data.headers.get("content-disposition")
-    if cd and "filename=" in cd:
-        raw_name = cd.split("filename=")[-1].strip('";\'')
-    else:
-        # Fallback: last path component of the URL (without query string)
-        raw_name = dlurl.split("/")[-1].split("?")[0]
+    raw_name = remote_filename(dlurl, data.headers)
 
     # final path
     if filename == "" or os.path.isdir(filename):
@@ -98,85 +434,220 @@ def download_a_file(url, filename="", session=None, cookies=None, rename_old=Tru
             dltime = data.headers["last-modified"]
             datalength = int(data.headers["content-length"])
             stats = os.stat(final_path)
-            if (dateparser.parse(dltime).timestamp() == stats.st_mtime and datalength == stats.st_size):
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"[INFO] File {final_path} already fully downloaded - skipping")
+            if (httpdate.timestamp(dltime) == stats.st_mtime and datalength == stats.st_size):
+                events.info(f"File {final_path} already fully downloaded - skipping", event="download_skip", path=final_path, reason="identical", size=datalength)
+                if info is not None:
+                    info.update(path=final_path, size=datalength, last_modified=dltime)
                 return False
         except Exception:
             # If any header is missing we just fall through to a fresh download
             pass
 
-    # Store data stream / GET
-    if is_cloudflare:
-        # We initialized with GET
-        data_stream = data
-    else:
-        # For the normal CDN case we now do the real GET
-        data_stream = session.get(dlurl, stream=True, cookies=cookies)
-        if data_stream.status_code != 200:
-            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} GET request failed ({data_stream.status_code})")
+    # the same upload downloaded before (e.g. for another item of a bundle) is linked from the dedup store
+    if dedup is not None and upload_id and data.headers.get("content-length") and data.headers.get("last-modified"):
+        datalength = int(data.headers["content-length"])
+        dltime = data.headers["last-modified"]
+        known, sha256, known_fast_hash = dedup.known_upload(upload_id, datalength, dltime)
+        if known is not None:
+            if is_cloudflare:
+                data.close()
+            if rename_old:
+                rename_old_file(final_path)
+            # a Last-Modified that is not a date leaves the link with the time of its source
+            ts = httpdate.timestamp(dltime)
+            ts = None if ts is None else int(ts)
+            method = dedup.link(known, final_path, ts)
+            if ts is not None:
+                os.utime(final_path, (ts, ts))
+            events.info(f"Content already downloaded, {method} of {known} created: {final_path}", event="download_skip", path=final_path, reason="dedup",
+                        size=datalength, method=method, source=known)
+            if info is not None:
+                # the fast hash goes along, a sha256 without it would clear the recorded one
+                info.update(path=final_path, size=datalength, last_modified=dltime, sha256=sha256, fast_hash=known_fast_hash)
+            return True
+
+    incompletefilename = final_path + ".incomplete"
+    segmented = use_segments(data.headers, segments, segment_threshold)
+
+    if segmented:
+        # large file, the byte ranges are fetched over several connections into a preallocated .incomplete file
+        if is_cloudflare:
+            data.close()
+        datalength = int(data.headers["content-length"])
+        resume_from = 0
+
+        allocated = os.path.isfile(incompletefilename) and os.path.getsize(incompletefilename) == datalength
+        if not allocated and not enough_disk_space(incompletefilename, datalength):
             return False
 
-    # Rename old file if requested (only when a *file* exists, not a dir)
-    if os.path.exists(final_path) and rename_old:
-        now = datetime.now()
-        ts = now.strftime("%Y%m%d%H%M%S")
-        old_name = f"{final_path}_{ts}.old"
-        print(
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            + " "
-            + f"[INFO] Renaming {final_path} → {old_name}"
-        )
-        if os.path.exists(old_name):
-            os.remove(old_name)
-        os.rename(final_path, old_name)
-
-    # start download
-    if debugon:
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S")+ " " + f"[DEBUG] Starting download of {dlurl} → {final_path}")
+        # Rename old file if requested (only when a *file* exists, not a dir)
+        if rename_old:
+            rename_old_file(final_path)
+
+        extra = contextlib.nullcontext(segments - 1) if host_slots is None else host_slots.extra_slots(dlurl, segments - 1)
+        with extra as more:
+            events.info(f"Starting download of {final_path} over {1 + more} connections", event="download_start", path=final_path, size=datalength, segments=1 + more)
+            starttime = time.time()
+            with profiling.stage("cdn_transfer"):
+                datadownloaded = download_segmented(dlurl, session, cookies, data.headers, incompletefilename, datalength, segments, final_path, showprogress=showprogress, debugon=debugon,
+                                                    chunk_size=chunk_size, buffer_size=buffer_size, fsync=fsync, limiter=limiter, connections=1 + more)
+        # ranges arrive out of order, the file is hashed once complete
+        hashers = hash_file(incompletefilename, hashers=[h for h in (hashlib.sha256(), fast_hasher(fast_hash)) if h is not None])
     else:
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S")+ " "+ f"[INFO] Starting download of {final_path}")
+        resume_from = resumable_size(incompletefilename, data.headers)
 
-    incompletefilename = final_path + ".incomplete"
-    starttime = time.time()
-    datadownloaded = 0
+        # Store data stream / GET
+        if is_cloudflare and not resume_from:
+            # We initialized with GET
+            data_stream = data
+        else:
+            if is_cloudflare:
+                # the first GET started from byte zero, continue the .incomplete file with a new one
+                data.close()
+            headers = {}
+            if resume_from:
+                headers["Range"] = f"bytes={resume_from}-"
+                # the server answers with the full file (200) instead of the range if the file changed in the meantime
+                headers["If-Range"] = validator_of(data.headers)
+            data_stream = session.get(dlurl, stream=True, cookies=cookies, headers=headers)
+            if is_cloudflare and data_stream.status_code in (401, 403):
+                # signed url expired, the caller fetches a new one and tries again
+                data_stream.raise_for_status()
+            if data_stream.status_code == 206 and not content_range_matches(data_stream.headers, resume_from, data.headers):
+                data_stream.close()
+                data_stream = session.get(dlurl, stream=True, cookies=cookies)
+            if data_stream.status_code not in (200, 206):
+                raise_for_answer(data_stream, "GET request")
+            if data_stream.status_code == 200 and resume_from:
+                events.info(f"Remote file changed, restarting download of {final_path}")
+        if data_stream.status_code != 206:
+            resume_from = 0
 
-    # Get the expected length (might be missing for Cloudflare URLs)
-    try:
-        datalength = int(data_stream.headers.get("content-length", 0))
-    except Exception:
-        datalength = 0
-
-    with open(incompletefilename, "wb") as f:
-        for chunk in data_stream.iter_content(chunk_size=8192):
-            if not chunk:
-                continue
-            f.write(chunk)
-            datadownloaded += len(chunk)
-            difftime = time.time() - starttime
-            if difftime == 0:
-                kbs = (datadownloaded / 1) / 1024
-            else:
-                kbs = (datadownloaded / difftime) / 1024
-            suffix = os.path.basename(final_path)
-            prefix = f"{round(datadownloaded/1024/1024,1)}/{round(datalength/1024/1024,1)} MB ({round(kbs,1)} KB/s)"
-            printProgressBar(datadownloaded, datalength, suffix=suffix, prefix=prefix, usepercent=False, debugon=debugon)
+        # Get the expected length (might be missing for Cloudflare URLs)
+        try:
+            datalength = int(data_stream.headers.get("content-length", 0))
+            if datalength and resume_from:
+                datalength = datalength + resume_from
+        except Exception:
+            datalength = 0
+
+        # a preallocated .incomplete file already has its disk space
+        if resume_from:
+            preallocated = "written" in (read_resume_info(incompletefilename) or {})
+        else:
+            preallocated = preallocate and datalength > 0
+        if datalength and not (resume_from and preallocated) and not enough_disk_space(incompletefilename, datalength - resume_from):
+            data_stream.close()
+            return False
+
+        # Rename old file if requested (only when a *file* exists, not a dir)
+        if rename_old:
+            rename_old_file(final_path)
+
+        # start download
+        if debugon:
+            events.debug(f"Starting download of {dlurl} → {final_path}", event="download_start", path=final_path, size=datalength, resume_from=resume_from)
+        elif resume_from:
+            events.info(f"Resuming download of {final_path} at {round(resume_from/1024/1024,1)} MB", event="download_start", path=final_path, size=datalength, resume_from=resume_from)
+        else:
+            events.info(f"Starting download of {final_path}", event="download_start", path=final_path, size=datalength, resume_from=0)
+
+        starttime = time.time()
+        datadownloaded = resume_from
+
+        # remember what is being downloaded, so an interrupted download can be continued on the next try
+        resumeheaders = data.headers if resume_from else data_stream.headers
+        if not resume_from:
+            write_resume_info(incompletefilename, resumeheaders, datalength, written=0 if preallocated else None)
+
+        # hashes computed while the file is written, the part downloaded by an earlier try is read once
+        hashers = [h for h in (hashlib.sha256(), fast_hasher(fast_hash)) if h is not None]
+        if resume_from:
+            hash_file(incompletefilename, resume_from, hashers)
+
+        # the written offset of a preallocated file is saved every checkpoint bytes
+        checkpoint = fsync_interval or 64 * 1024 * 1024
+        nextcheckpoint = datadownloaded + checkpoint
 
-    # finish download
+        if showprogress:
+            transfer = display.start(os.path.basename(final_path), datalength, resume_from)
+        try:
+            with profiling.stage("cdn_transfer"), open(incompletefilename, "r+b" if resume_from else "wb", buffering=buffer_size) as f:
+                if preallocated and not resume_from:
+                    preallocate_file(f, datalength)
+                f.seek(resume_from)
+                try:
+                    for chunk in data_stream.iter_content(chunk_size=chunk_size):
+                        if not chunk:
+                            continue
+                        if limiter is not None:
+                            limiter.throttle(len(chunk))
+                        f.write(chunk)
+                        for hasher in hashers:
+                            hasher.update(chunk)
+                        datadownloaded += len(chunk)
+                        if showprogress:
+                            display.update(transfer, datadownloaded)
+                        if datadownloaded >= nextcheckpoint:
+                            f.flush()
+                            # the saved offset must not get ahead of the data on the disk
+                            if fsync or preallocated:
+                                os.fsync(f.fileno())
+                            if preallocated:
+                                write_resume_info(incompletefilename, resumeheaders, datalength, written=datadownloaded)
+                            nextcheckpoint = datadownloaded + checkpoint
+                    if fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+                finally:
+                    if preallocated:
+                        # an interrupted download continues after the bytes written so far
+                        f.flush()
+                        os.fsync(f.fileno())
+                        write_resume_info(incompletefilename, resumeheaders, datalength, written=datadownloaded)
+        finally:
+            if showprogress:
+                display.finish(transfer)
+
+        if preallocated and datadownloaded != datalength:
+            # the size of a preallocated file is right from the start, the bytes received are what counts
+            raise IOError(f"connection closed after {datadownloaded} of {datalength} bytes of {final_path}")
+
+    # finish download (with fsync, the rename is forced to the disk as well as the content)
     os.rename(incompletefilename, final_path)
+    if fsync:
+        atomicfile.fsync_directory(os.path.dirname(os.path.abspath(final_path)))
+    remove_resume_info(incompletefilename)
+    difftime = max(time.time() - starttime, 0.001)
+    events.info(f"Finished download of {final_path} ({round(datadownloaded/1024/1024,1)} MB, {round((datadownloaded - resume_from)/difftime/1024,1)} KB/s)",
+                event="download_end", path=final_path, size=datadownloaded, bytes=datadownloaded - resume_from, seconds=round(difftime, 3),
+                bytes_per_second=round((datadownloaded - resume_from)/difftime), segmented=segmented)
 
     # check size
     sizeondisk = os.path.getsize(final_path)
     if debugon:
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + "filename: {}, disk: {}, http: {}".format(filename, sizeondisk, datalength))
+        events.debug("filename: {}, disk: {}, http: {}".format(filename, sizeondisk, datalength))
     if datalength and sizeondisk != datalength:
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] Size on Disk differs from HTTP")
+        events.info("Size on Disk differs from HTTP")
         return False
 
     # touch up timestamp
     dltime = data.headers.get("last-modified")
-    if dltime:
-        ts = int(dateparser.parse(dltime).timestamp())
+    ts = httpdate.timestamp(dltime)
+    if ts is not None:
+        ts = int(ts)
         os.utime(final_path, (ts, ts))
 
+    sha256 = hashers[0].hexdigest()
+    if dedup is not None:
+        method = dedup.add(final_path, sha256, sizeondisk)
+        if method is not None:
+            events.info(f"Same content as an earlier download, replaced by a {method}: {final_path}", event="dedup", path=final_path, method=method)
+
+    if info is not None:
+        info.update(path=final_path, size=sizeondisk, last_modified=dltime, sha256=sha256)
+        if len(hashers) > 1:
+            info.update(fast_hash=hash_digest(fast_hash, hashers[1]))
+
     # done
     return True
@@ -0,0 +1,116 @@
+# structured event log: every log line and measurement is an event, appended as one JSON line to the event log file
+# (when enabled) and shown on the console as the usual "<time> [LEVEL] message" line
+
+import json
+import threading
+import time
+import traceback
+
+from contextlib import contextmanager
+from datetime import datetime
+
+from colorama import Fore
+from colorama import Style
+
+COLORS = {"WARNING": Fore.YELLOW, "ERROR": Fore.RED}
+
+class EventLog:
+    """
+    Writes the events of every thread to the JSON-lines file and the console
+    @params:
+        path        - Optional  : JSON-lines file the events are appended to, None = console only (Str)
+        debugon     - Optional  : DEBUG events are shown on the console too (Bool)
+    """
+
+    def __init__(self, path=None, debugon=False):
+        self._lock = threading.Lock()
+        self._file = None
+        self.path = None
+        self.debugon = debugon
+        self.configure(path, debugon)
+
+    def configure(self, path=None, debugon=False):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = path
+            self.debugon = debugon
+            if path:
+                self._file = open(path, "a", encoding="utf-8")
+
+    def close(self):
+        self.configure(None, self.debugon)
+
+    def emit(self, event, level="INFO", msg=None, **fields):
+        """
+        @params:
+            event       - Required  : kind of event, e.g. "download_end" (Str)
+            level       - Optional  : DEBUG, INFO, WARNING or ERROR (Str)
+            msg         - Optional  : console line, events without one are only written to the file (Str)
+            fields      - Optional  : measurements and details of the event, JSON serializable
+        """
+        now = time.time()
+        if self._file is not None:
+            record = {"ts": round(now, 3), "level": level, "event": event, "thread": threading.current_thread().name}
+            if msg is not None:
+                record["msg"] = msg
+            record.update(fields)
+            line = json.dumps(record, default=str, ensure_ascii=False)
+            with self._lock:
+                if self._file is not None:
+                    self._file.write(line + "\n")
+                    self._file.flush()
+        if msg is not None:
+            self.console(level, msg, now)
+
+    def console(self, level, msg, when=None):
+        # the log line only, DEBUG lines are left out unless debugon
+        if level == "DEBUG" and not self.debugon:
+            return
+        if level in COLORS:
+            tag = f"{COLORS[level]}[{level}]{Style.RESET_ALL}"
+        else:
+            tag = f"[{level}]"
+        print(datetime.fromtimestamp(when or time.time()).strftime("%Y-%m-%d %H:%M:%S") + " " + tag + " " + msg)
+
+# shared by all the modules of the process, set up by the main script
+log = EventLog()
+
+def configure(path=None, debugon=False):
+    log.configure(path, debugon)
+
+def emit(event, level="INFO", msg=None, **fields):
+    log.emit(event, level, msg, **fields)
+
+def debug(msg, event="log", **fields):
+    log.emit(event, "DEBUG", msg, **fields)
+
+def info(msg, event="log", **fields):
+    log.emit(event, "INFO", msg, **fields)
+
+def warning(msg, event="log", **fields):
+    log.emit(event, "WARNING", msg, **fields)
+
+def error(msg, event="log", **fields):
+    log.emit(event, "ERROR", msg, **fields)
+
+def exception(msg, event="error", level="ERROR", **fields):
+    # error with the traceback of the exception being handled, framed on the console as before
+    trace = traceback.format_exc()
+    log.emit(event, level, msg, traceback=trace, **fields)
+    log.console(level, "=====================================")
+    print(trace, end="")
+    log.console(level, "=====================================")
+
+@contextmanager
+def timer(event, level="DEBUG", msg=None, **fields):
+    """
+    Emits event with the seconds the block took, the block can add fields to the yielded dict
+    """
+    starttime = time.monotonic()
+    try:
+        yield fields
+    finally:
+        fields["seconds"] = round(time.monotonic() - starttime, 3)
+        log.emit(event, level, msg, **fields)
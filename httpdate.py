@@ -0,0 +1,40 @@
+# HTTP dates (Last-Modified and the like): RFC 7231 formats are parsed directly and cached, since the same header is
+# read several times per upload. dateparser is only loaded for the odd server sending something else
+
+import email.utils
+import functools
+
+from datetime import timezone
+
+@functools.lru_cache(maxsize=4096)
+def parse(value):
+    """
+    Parses an HTTP date
+    @params:
+        value       - Required  : header value, e.g. "Sun, 06 Nov 1994 08:49:37 GMT" (Str)
+    returns a timezone aware datetime, None if the value is not a date
+    """
+    if not value:
+        return None
+    try:
+        # IMF-fixdate, the obsolete RFC 850 and asctime forms
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        import dateparser
+
+        parsed = dateparser.parse(value)
+        if parsed is None:
+            return None
+    if parsed.tzinfo is None:
+        # HTTP dates without a zone (asctime, "-0000") are in UTC
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def timestamp(value):
+    """
+    Seconds since the epoch of an HTTP date, None if the value is not a date
+    @params:
+        value       - Required  : header value (Str)
+    """
+    parsed = parse(value)
+    return None if parsed is None else parsed.timestamp()
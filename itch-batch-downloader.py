@@ -2,19 +2,36 @@
 Based on https://github.com/shakeyourbunny/itch-downloader
 """
 
+import argparse
+import collections
 import configparser
+import contextlib
 import json
+import multiprocessing
 import os
 import sys
 import time
 from http.cookiejar import MozillaCookieJar
 
-import dateparser
 import requests
+import requests.adapters
 import requests.cookies
-from bs4 import BeautifulSoup
 
+import atomicfile
 import dltool
+import events
+import httpdate
+import profiling
+import pageparse
+import scheduler as dlscheduler
+from manifest import Manifest
+from dedup import DedupStore
+import verify
+import retry
+import plan
+import shard
+import bandwidth
+from browserpool import BrowserPool
 import unicodedata
 import re
 import pickle
@@ -22,27 +39,12 @@ import pickle
 from datetime import datetime
 import subprocess
 import codecs
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.support.expected_conditions import staleness_of
-
-import util
 import pathlib
 from pathlib import Path
 import glob
 import base64
-import yt_dlp
-import traceback
-
-from colorama import Fore
-from colorama import Style
 
 version = "0.1.0"
 
@@ -50,6 +52,20 @@ version = "0.1.0"
 # the .png and .pdf files
 global newDownloads
 
+# global bandwidth limit shared by all the transfers (bandwidth.BandwidthLimiter), set up by main()
+bandwidthLimiter = None
+
+# lease files of the game directories this process writes (shard.LeaseDirectory) and its item counters (shard.Progress), set up by main()
+itemLeases = None
+shardProgress = None
+
+# product page captures running on browser_pool_size threads, and the (game directory, future) of each in item order, set up by main()
+pageCaptures = None
+capturing = collections.deque()
+
+# start of the current run (also of an interrupted one being continued): pieces of items checkpointed since then are done, set up by main()
+checkpointSince = None
+
 # yt-dlp logger class, used to make the yt-dlp output formatted the same as the rest of the logs
 class ydLogger:
     def debug(self, msg):
@@ -57,23 +73,48 @@ class ydLogger:
         # You can distinguish them by the prefix '[debug] '
         if msg.startswith('[debug] '):
             if config["DEFAULT"]["debug_logs"] == "ON": 
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] External links downloader: " + msg)
+                events.debug("External links downloader: " + msg, event="ytdlp")
         else:
-            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] External links downloader: " + msg)
+            events.info("External links downloader: " + msg, event="ytdlp")
 
     def info(self, msg):
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] External links downloader: " + msg)
+        events.info("External links downloader: " + msg, event="ytdlp")
 
     def warning(self, msg):
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.YELLOW}[WARNING]{Style.RESET_ALL} External links downloader: " + msg)
+        events.warning("External links downloader: " + msg, event="ytdlp")
 
     def error(self, msg):
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} External links downloader: " + msg)
+        events.error("External links downloader: " + msg, event="ytdlp")
 
 # yt-dlp hook
 def yd_hook(d):
     if d['status'] == 'finished':
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] External links downloader: done downloading, now post-processing ...")
+        events.info("External links downloader: done downloading, now post-processing ...", event="video_end", path=d.get('filename'),
+                    size=d.get('total_bytes') or d.get('downloaded_bytes'), seconds=d.get('elapsed'))
+
+def yd_bandwidth_hook():
+    # yt-dlp hook taking the bytes received since the last call from the global bandwidth limit, so videos share it
+    received = {}
+    def hook(d):
+        if d['status'] != 'downloading' or bandwidthLimiter is None or not d.get('downloaded_bytes'):
+            return
+        name = d.get('filename')
+        delta = d['downloaded_bytes'] - received.get(name, 0)
+        received[name] = d['downloaded_bytes']
+        if delta > 0:
+            bandwidthLimiter.throttle(delta)
+    return hook
+
+def yd_record_hook(manifest, itemurl):
+    # yt-dlp postprocessor hook recording the final file of a video in the manifest. the "finished" progress hook names
+    # the .fNNN streams, which are deleted once merged, the file is only in place after MoveFiles
+    def hook(d):
+        if d['status'] != 'finished' or d.get('postprocessor') != 'MoveFiles' or not d['info_dict'].get('filepath'):
+            return
+        filepath = d['info_dict']['filepath']
+        finaldir = d['info_dict'].get('__finaldir') or os.path.dirname(filepath)
+        manifest.record_artifact(itemurl, "video", os.path.join(finaldir, os.path.basename(filepath)))
+    return hook
 
 def local_file_sanity_check(localfile, localsize, localdate, remotesize, remotedate):
     if not os.path.isfile(localfile):
@@ -127,13 +168,104 @@ def slugify(value, allow_unicode=False, is_value_a_filename=False):
     
     return value
 
-def fetch_upload(uploads_soup, dlurl, session, params, csfrtoken, gamedirectory, fileNr, full_page_soup=None):
-    # returns true if the file was downloaded
+def get_download_json(dlurl, session, params, csfrtoken, downloadid=None):
+    # Build the request that yields the JSON with the real file URL.
+    with profiling.stage("download_json"):
+        if downloadid is None:
+            # The endpoint returns JSON directly – just GET it.
+            r = session.get(dlurl, params=params, cookies=session.cookies)
+        else:
+            # Use the original code
+            dlurl_final = f"{dlurl}/file/{downloadid}"
+            r = session.post(dlurl_final, params=params, data=csfrtoken)
+        # an error page is not JSON, the HTTPError tells the retry whether the session tried it already
+        r.raise_for_status()
+        return r.json()
+
+def transfer_slot(scheduler, url):
+    # per host concurrency cap, nothing to limit when files are downloaded one by one
+    if scheduler is None:
+        return contextlib.nullcontext()
+    return scheduler.host_slot(url)
+
+def retry_policy():
+    # retries of requests and downloads, from the config file
+    return retry.RetryPolicy(
+        attempts=config["DEFAULT"].getint("retry_attempts"),
+        base=config["DEFAULT"].getfloat("retry_backoff_seconds"),
+    )
+
+def transfer_options():
+    # settings of dltool.download_a_file taken from the config file
+    return {
+        "segments": config["DEFAULT"].getint("segmented_connections"),
+        "segment_threshold": config["DEFAULT"].getint("segmented_threshold_mb") * 1024 * 1024,
+        "chunk_size": config["DEFAULT"].getint("download_chunk_kb") * 1024,
+        "buffer_size": config["DEFAULT"].getint("write_buffer_kb") * 1024,
+        "preallocate": config["DEFAULT"]["preallocate_downloads"] == "ON",
+        "fsync": config["DEFAULT"]["fsync_downloads"] == "ON",
+        "fsync_interval": config["DEFAULT"].getint("fsync_interval_mb") * 1024 * 1024,
+        "fast_hash": fast_hash_setting(),
+        "limiter": bandwidthLimiter,
+    }
+
+def open_manifest():
+    # the manifest of the download directory, shared with the other workers of a sharded run
+    return Manifest(os.path.join(config["DEFAULT"]["download_directory"], "itch-batch-downloader.db"), wal=config["DEFAULT"]["manifest_wal"] == "ON")
+
+def count_progress(key):
+    if shardProgress is not None:
+        shardProgress.add(key)
+
+def release_item(gamedirectory):
+    # the game directory may be written by another worker again
+    if itemLeases is not None:
+        itemLeases.release(gamedirectory)
+
+def piece_done(manifest, itemurl, piece):
+    # checkpoint of a piece of the item finished by this run, None if it still has to be done
+    if manifest is None or checkpointSince is None:
+        return None
+    return manifest.checkpoint(itemurl, piece, checkpointSince)
+
+def checkpoint_piece(manifest, itemurl, piece, result=None):
+    # written once the piece is complete on disk, an interrupted run does not do it again
+    if manifest is not None:
+        manifest.set_checkpoint(itemurl, piece, result)
+
+def fast_hash_setting():
+    # xxh3, blake2b or None when the config setting is OFF
+    if config["DEFAULT"]["fast_hash"] in ("xxh3", "blake2b"):
+        return config["DEFAULT"]["fast_hash"]
+    return None
+
+def upload_identity(uploads_soup, gamedirectory, fileNr):
+    # manifest key, upload id and file name of an upload as shown on the item page
+    upload_id = None
+    link = uploads_soup.find("a", attrs={"data-upload_id": True})
+    if link is not None:
+        upload_id = link["data-upload_id"]
+    remote_filename = ""
+    name_tag = uploads_soup.find(class_="name")
+    if name_tag is not None:
+        remote_filename = name_tag.get("title") or name_tag.text.strip()
+    return gamedirectory + "/" + (upload_id or str(fileNr)), upload_id, remote_filename
+
+def record_upload(manifest, itemurl, uploads_soup, gamedirectory, fileNr, dlinfo):
+    # dlinfo is filled in by dltool.download_a_file, empty if there is no local file
+    if manifest is None or "path" not in dlinfo:
+        return
+    key, upload_id, remote_filename = upload_identity(uploads_soup, gamedirectory, fileNr)
+    manifest.record_upload(key, itemurl, upload_id, remote_filename, dlinfo["size"], dlinfo["last_modified"], dlinfo["path"], dlinfo.get("sha256"), dlinfo.get("fast_hash"))
+
+def find_upload_link(uploads_soup, dlurl, page=None):
+    # returns the url to ask for the download JSON and the upload id (None for the newer direct endpoint),
+    # (None, None) if the upload has no download link
     # Find the upload identifier – try the old attribute first, then fall back to the newer href‑based format.
     try:
         # Old style (in case it's an older page)
         downloadid = uploads_soup.find("a")["data-upload_id"]
-        use_direct_endpoint = False
+        return dlurl, downloadid
     except (TypeError, KeyError):
         # New style – look for a link that contains "/download/"
         dl_link = None
@@ -146,47 +278,90 @@ def fetch_upload(uploads_soup, dlurl, session, params, csfrtoken, gamedirectory,
                 break
         
         # If the upload block did NOT contain a download link, fall back to the whole page.
-        if not dl_link and full_page_soup is not None:
-            banner_btn = full_page_soup.find(
-                "a",
-                class_="button",
-                href=lambda h: h and "/download/" in h,
-            )
-            if banner_btn:
-                dl_link = banner_btn["href"]
+        if not dl_link and page is not None and page["download_links"]:
+            dl_link = page["download_links"][0]
 
         # Otherwise give up
         if not dl_link:
-            print(
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                + " "
-                + f"{Fore.YELLOW}[WARNING]{Style.RESET_ALL} Skipped a file (no download button found): {dlurl}"
-            )
-            return False
-
-        dlurl = dl_link
-        use_direct_endpoint = True
+            events.warning(f"Skipped a file (no download button found): {dlurl}")
+            return None, None
+
+        return dl_link, None
     # for everything else use original code
     except:
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.YELLOW}[WARNING]{Style.RESET_ALL} Skipped a file: {dlurl}")
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.YELLOW}[WARNING]{Style.RESET_ALL} =====================================")
-        traceback.print_exc()
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.YELLOW}[WARNING]{Style.RESET_ALL} =====================================")
-        return False
+        events.exception(f"Skipped a file: {dlurl}", level="WARNING")
+        return None, None
 
-    # Build the request that yields the JSON with the real file URL.
-    if use_direct_endpoint:
-        # The endpoint returns JSON directly – just GET it.
-        dlj = session.get(dlurl, params=params, cookies=session.cookies).json()
+def config_list(key):
+    # comma separated config setting
+    return [value.strip() for value in config["DEFAULT"][key].split(",") if value.strip()]
+
+def is_mirror_domain(domain):
+    # Cloudflare‑mirrored URLs (don't have a "Last Modified" header)
+    return any(host in domain for host in config_list("mirror_hosts"))
+
+def is_cdn_domain(domain):
+    # the hwcdn CDN, answers HEAD requests with the file name, size and date
+    return domain in config_list("cdn_hosts")
+
+def head_remote_file(session, url):
+    # Last-Modified, file name, size and headers of a file of the hwcdn CDN
+    with profiling.stage("cdn_head"):
+        dlhead = session.head(url)
+    dlhead.raise_for_status()
+    dldate = dlhead.headers["last-modified"]
+    if "content-disposition" in dlhead.headers:
+        dlfilename = dlhead.headers["content-disposition"].split('"')[1]
+    else:
+        dlfilename = url.split("?")[0].split("/")[-1]
+    return dldate, dlfilename, dlhead.headers["content-length"], dlhead.headers
+
+def versioned_filenames(fileNr, dlfilename, dldate):
+    # file name of older versions and the one with the date stamp of the remote file, both unique and unicode compatible
+    dlfilename = str(fileNr) + "_" + slugify(dlfilename, False, True)
+
+    suf = pathlib.Path(dlfilename).suffix
+    suf.strip()
+    if len(suf) > 0:
+        if (suf[0] == "."):
+            suf = suf[1:]
+    datestamp = httpdate.parse(dldate).strftime("%Y%m%d")
+    if not suf or suf == "":
+        newdlname = dlfilename + "_{}".format(datestamp)
     else:
-        # Use the original code
-        dlurl_final = f"{dlurl}/file/{downloadid}"
-        dlj = session.post(dlurl_final, params=params, data=csfrtoken).json()
+        newdlname = dlfilename.replace("." + suf, "_{}.{}".format(datestamp, suf))
+    return dlfilename, newdlname
+
+def prefetched_upload(manifest, upload_key):
+    # remote metadata of the upload checked by a recent plan (--plan), None if there is none
+    minutes = config["DEFAULT"].getfloat("plan_reuse_minutes")
+    if manifest is None or minutes <= 0:
+        return None
+    return manifest.remote_file(upload_key, time.time() - minutes * 60)
+
+def fetch_upload(uploads_soup, dlurl, session, params, csfrtoken, gamedirectory, fileNr, page=None, scheduler=None, manifest=None, itemurl=None, dedup=None):
+    # returns true if the file was downloaded
+    # the running downloads share one status display (dltool.display), only drawn on a terminal
+    showprogress = True
+    dlurl, downloadid = find_upload_link(uploads_soup, dlurl, page)
+    if dlurl is None:
+        return False
+
+    # a recent plan already found the local file identical to the remote one, itch.io is not asked again
+    prefetched = prefetched_upload(manifest, upload_identity(uploads_soup, gamedirectory, fileNr)[0])
+    if prefetched is not None and plan.local_action(prefetched["local_path"], prefetched["size"], prefetched["last_modified"]) == plan.SKIP:
+        events.info(f"File {prefetched['local_path']} already fully downloaded (checked by the plan) - skipping", event="download_skip",
+                    path=prefetched["local_path"], reason="plan", size=prefetched["size"])
+        record_upload(manifest, itemurl, uploads_soup, gamedirectory, fileNr,
+                      {"path": prefetched["local_path"], "size": prefetched["size"], "last_modified": prefetched["last_modified"]})
+        return False
+
+    dlj = get_download_json(dlurl, session, params, csfrtoken, downloadid)
 
     domain = dlj["url"].split("/")[2]
 
     # Cloudflare‑mirrored URLs (don't have a "Last Modified" header)
-    if "cloudflarestorage.com" in domain or domain.startswith("itchio-mirror"):
+    if is_mirror_domain(domain):
         # Build the directory where the file will be stored (same as the original script does for CDN files).
         fulldldir = os.path.join(
             config["DEFAULT"]["download_directory"], gamedirectory
@@ -195,41 +370,44 @@ def fetch_upload(uploads_soup, dlurl, session, params, csfrtoken, gamedirectory,
 
         # Call the downloader.  `debugon` mirrors the original behaviour.
         debugon = config["DEFAULT"]["debug_logs"] == "ON"
-        was_the_file_downloaded = dltool.download_a_file(
-            dlj["url"],               # the Cloudflare‑mirrored URL
-            filename=fulldldir,     # empty filename → use server‑provided name
-            session=session,
-            debugon=debugon,
-        )
+        dlinfo = {}
+
+        def download(attempt):
+            if attempt > 0:
+                # signed urls expire quickly, a fresh one is needed to continue the .incomplete file
+                dlj.update(get_download_json(dlurl, session, params, csfrtoken, downloadid))
+            with transfer_slot(scheduler, dlj["url"]):
+                return dltool.download_a_file(
+                    dlj["url"],               # the Cloudflare‑mirrored URL
+                    filename=fulldldir,     # empty filename → use server‑provided name
+                    session=session,
+                    debugon=debugon,
+                    showprogress=showprogress,
+                    info=dlinfo,
+                    dedup=dedup,
+                    upload_id=upload_identity(uploads_soup, gamedirectory, fileNr)[1],
+                    is_mirror=True,
+                    host_slots=scheduler,
+                    **transfer_options(),
+                )
+
+        # retried with backoff, retry.GaveUp fails the item which is tried again in a later pass
+        was_the_file_downloaded = retry_policy().run(download, "Download to {}".format(fulldldir))
+
+        record_upload(manifest, itemurl, uploads_soup, gamedirectory, fileNr, dlinfo)
         return was_the_file_downloaded
 
     # Original code
-    elif domain == "w3g3a5v6.ssl.hwcdn.net":
-        # remote file check
-        x = 0
-        while x < 3:
-            try:                
-                dlhead = session.head(dlj["url"])
-                dldate = dlhead.headers["last-modified"]
-                if "content-disposition" in dlhead.headers:
-                    dlfilename = dlhead.headers["content-disposition"].split('"')[1]
-                else:
-                    dlfilename = dlj["url"].split("?")[0].split("/")[-1]
-                dlsize = dlhead.headers["content-length"]
-                x = 4
-            except:
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} Connection error. Retry " + str(x+1) + " of 3")
-                x = x + 1
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                traceback.print_exc()
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-            finally:
-                if x == 3:
-                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} Cannot recover from connection error. Quitting ...")
-                    sys.exit(1)
-        
+    elif is_cdn_domain(domain):
+        # remote file check, unless a recent plan already made it
+        if prefetched is not None:
+            dldate, dlfilename = prefetched["last_modified"], prefetched["remote_filename"]
+        else:
+            dldate, dlfilename = retry_policy().run(lambda attempt: head_remote_file(session, dlj["url"])[:2],
+                                                    "Remote file check of {}".format(dlj["url"].split("?")[0]))
+
         # make filename unique and unicode compatible
-        dlfilename = str(fileNr) + "_" + slugify(dlfilename, False, True)
+        dlfilename, newdlname = versioned_filenames(fileNr, dlfilename, dldate)
 
         # local preparation
         fulldldir = os.path.join(config["DEFAULT"]["download_directory"], gamedirectory)
@@ -237,16 +415,6 @@ def fetch_upload(uploads_soup, dlurl, session, params, csfrtoken, gamedirectory,
         fulldname = os.path.join(fulldldir, dlfilename)
 
         # rename files if exist
-        suf = pathlib.Path(dlfilename).suffix
-        suf.strip()
-        if len(suf) > 0:
-            if (suf[0] == "."):
-                suf = suf[1:]
-        if not suf or suf == "":
-            newdlname = dlfilename + "_{}".format(dateparser.parse(dldate).strftime("%Y%m%d"))
-        else:
-            newdlname = dlfilename.replace("." + suf, "_{}.{}".format(dateparser.parse(dldate).strftime("%Y%m%d"), suf))
-        
         newfulldname = os.path.join(fulldldir, newdlname)
         
         # old format
@@ -261,47 +429,570 @@ def fetch_upload(uploads_soup, dlurl, session, params, csfrtoken, gamedirectory,
         fulldname = newfulldname
         
         # do the download
-        wasTheFileDownloaded = False
-        downloadRetries = 0
-        while downloadRetries < 3:
-            try:
-                if config["DEFAULT"]["debug_logs"] == "ON":
-                    debugon = True
-                    wasTheFileDownloaded = dltool.download_a_file(dlj["url"], filename=fulldname, session=session, debugon=debugon)
-                    downloadRetries = 4
-                else:
-                    debugon = False
-                    wasTheFileDownloaded = dltool.download_a_file(dlj["url"], filename=fulldname, session=session, debugon=debugon)
-                    downloadRetries = 4
-            except:
-                wasTheFileDownloaded = False
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL}" + " Error while downloading - url: {}, filename: {}".format(dlj["url"], fulldname))
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                traceback.print_exc()
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL}" + " Retry " + str(downloadRetries + 1) + " of 3")
-                downloadRetries = downloadRetries + 1
-            finally:
-                if downloadRetries == 3:
-                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} Cannot recover from connection error. Quitting ...")
-                    sys.exit(1)
+        dlinfo = {}
+        debugon = config["DEFAULT"]["debug_logs"] == "ON"
 
+        def download(attempt):
+            if attempt > 0:
+                # the .incomplete file is continued, with a fresh url in case the previous one expired
+                dlj.update(get_download_json(dlurl, session, params, csfrtoken, downloadid))
+            with transfer_slot(scheduler, dlj["url"]):
+                return dltool.download_a_file(dlj["url"], filename=fulldname, session=session, debugon=debugon, showprogress=showprogress,
+                                              info=dlinfo, dedup=dedup, upload_id=upload_identity(uploads_soup, gamedirectory, fileNr)[1],
+                                              host_slots=scheduler, **transfer_options())
+
+        wasTheFileDownloaded = retry_policy().run(download, "Download of {}".format(fulldname))
+
+        record_upload(manifest, itemurl, uploads_soup, gamedirectory, fileNr, dlinfo)
         return wasTheFileDownloaded
 
     else:
         tempUrl = dlj["url"]
         if domain == "drive.google.com":
-            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.YELLOW}[WARNING]{Style.RESET_ALL} Download from Google Drive is UNSUPPORTED: {tempUrl}")
+            events.warning(f"Download from Google Drive is UNSUPPORTED: {tempUrl}", event="download_skip", reason="unsupported", url=tempUrl)
         else:
-            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.YELLOW}[WARNING]{Style.RESET_ALL} Skipped a file: {tempUrl}")
+            events.warning(f"Skipped a file: {tempUrl}", event="download_skip", reason="unsupported", url=tempUrl.split("?")[0])
         return False
 
-def main(config):
-    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] Download directory is '{}'".format(config["DEFAULT"]["download_directory"]))
+def checkpointed_upload(uploads_soup, dlurl, session, params, csfrtoken, gamedirectory, fileNr, manifest=None, itemurl=None, **kwargs):
+    # fetch_upload, unless the upload was finished by this run before it was interrupted. returns true if the file was downloaded
+    key = upload_identity(uploads_soup, gamedirectory, fileNr)[0]
+    done = piece_done(manifest, itemurl, "upload:" + key)
+    if done is not None:
+        known = manifest.upload(key)
+        if known is None or not known["local_path"] or os.path.isfile(known["local_path"]):
+            events.info("Upload {} already done by the interrupted run - skipping".format(key), event="download_skip", reason="checkpoint",
+                        path=known["local_path"] if known is not None else None)
+            return bool(done["result"])
+
+    wasTheFileDownloaded = fetch_upload(uploads_soup, dlurl, session, params, csfrtoken, gamedirectory, fileNr, manifest=manifest, itemurl=itemurl, **kwargs)
+    checkpoint_piece(manifest, itemurl, "upload:" + key, 1 if wasTheFileDownloaded else 0)
+    return wasTheFileDownloaded
+
+def page_artifact_exists(manifest, itemurl, download_dir, gamedirectory, kind):
+    # png / pdf of the product page made by an earlier run, the manifest saves scanning the directory
+    if manifest is not None:
+        found = manifest.has_artifact(itemurl, kind)
+        if found is not None:
+            return found
+    return len(glob.glob(os.path.join(download_dir, gamedirectory + "_webpage_screenshot_" + "*" + "." + kind))) > 0
+
+def screenshot_tiles(path):
+    # the png strips of a screenshot taken in tiles mode, listed by its .json index
+    if not path.endswith(".json"):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    return [os.path.join(os.path.dirname(path), tile["file"]) for tile in index["tiles"]]
+
+def capture_product_page(g, gamedirectory, newDownloads, cookiejar, browsers, manifest=None):
+    # product webpage screenshot, PDF and embedded videos of an item, newDownloads tells if any upload changed
+    URL = g["dlurl"].split("/")[0] + "//" + g["dlurl"].split("/")[2] + "/" + g["dlurl"].split("/")[3]
+    download_dir = os.path.join(os.path.abspath(config["DEFAULT"]["download_directory"]), gamedirectory)
+
+    # a browser is only needed when a screenshot or a PDF is actually going to be written for this item
+    createPng = False
+    if config["DEFAULT"]["create_png"] != "ON":
+        events.info("Screenshot creation disabled as config setting not equal to ON", event="capture_skip", kind="png", reason="disabled")
+    elif piece_done(manifest, g["dlurl"], "png") is not None:
+        events.info("Screenshot already taken by the interrupted run. Skipped.", event="capture_skip", kind="png", reason="checkpoint")
+    elif newDownloads or not page_artifact_exists(manifest, g["dlurl"], download_dir, gamedirectory, "png"):
+        createPng = True
+    else:
+        events.info("Recent screenshot exists. Skipped.", event="capture_skip", kind="png", reason="exists")
+
+    createPdf = False
+    if config["DEFAULT"]["create_pdf"] != "ON":
+        events.info("PDF creation disabled as config setting not equal to ON", event="capture_skip", kind="pdf", reason="disabled")
+    elif piece_done(manifest, g["dlurl"], "pdf") is not None:
+        events.info("PDF already created by the interrupted run. Skipped.", event="capture_skip", kind="pdf", reason="checkpoint")
+    elif newDownloads or not page_artifact_exists(manifest, g["dlurl"], download_dir, gamedirectory, "pdf"):
+        createPdf = True
+    else:
+        events.info("Recent PDF exists. Skipped.", event="capture_skip", kind="pdf", reason="exists")
+
+    if createPng or createPdf:
+        export_product_page(g, URL, download_dir, gamedirectory, createPng, createPdf, cookiejar, browsers, manifest)
+
+    # product videos are downloaded (youtube, vimeo, etc), no browser needed for them
+    if config["DEFAULT"]["download_videos"] == "ON":
+        download_product_videos(g, URL, download_dir, gamedirectory, manifest)
+    else:
+        events.info("Video downloads disabled as config setting not equal to ON")
+
+def export_product_page(g, URL, download_dir, gamedirectory, createPng, createPdf, cookiejar, browsers, manifest=None):
+    # product webpage screenshot is exported to image and PDF
+    # selenium and PIL (through util) are only loaded by the runs which capture a page
+    from selenium.common.exceptions import TimeoutException
+    import util
+
+    now = datetime.now()
+    dateyearmonthday = now.strftime("%Y%m%d")
+
+    # a browser of the pool, started on first use and reused for the following items
+    driver = browsers.acquire()
+
+    driver.cookies = cookiejar
+
+    try:
+        # page load until its images are there
+        with events.timer("page_render", url=URL):
+            try:
+                with profiling.stage("page_load"):
+                    driver.get(URL)
+            except:
+                driver.get(URL, verify=False)
+                events.exception("Cannot verify domain, connection insicure")
+
+            try:
+                with profiling.stage("wait_images"):
+                    util.wait_until_images_loaded(driver, 30)
+            except TimeoutException:
+                events.exception("Timeout error on: " + URL)
+
+        height = 1024 + driver.execute_script("return document.documentElement.scrollHeight;")
+        width = 1024 + driver.execute_script("return document.body.offsetWidth;")
+        driver.set_window_size(width, height)
+        driver.maximize_window()
+
+        # product webpage screenshot is exported to image
+        fullscrname = os.path.join(download_dir, gamedirectory + "_webpage_screenshot_" + dateyearmonthday + ".png")
+
+        if config["DEFAULT"]["debug_logs"] == "ON": 
+            events.debug("Taking screenshot and creating PDF with Selenium, width: " + str(width) + ", height: " + str(height))
+
+        dir_check = Path(download_dir)
+        if not dir_check.is_dir():
+            os.mkdir(download_dir)
+
+        if createPng:
+            try:
+                debugon = True
+                starttime = time.time()
+                with profiling.stage("screenshot"):
+                    fullscrname = util.fullpage_screenshot(driver, fullscrname, debugon, config["DEFAULT"]["screenshot_mode"])
+                if manifest is not None:
+                    manifest.record_artifact(g["dlurl"], "png", fullscrname)
+                    for tile in screenshot_tiles(fullscrname):
+                        manifest.record_artifact(g["dlurl"], "png_tile", tile)
+                checkpoint_piece(manifest, g["dlurl"], "png")
+                events.info("Screenshot taken: " + fullscrname, event="screenshot", path=fullscrname, size=os.path.getsize(fullscrname),
+                            seconds=round(time.time() - starttime, 3), width=width, height=height)
+            except:
+                events.exception("Error while writing file: " + fullscrname)
+
+        # product webpage screenshot is exported to pdf
+        fullpdfname = os.path.join(download_dir, f"{gamedirectory}_webpage_screenshot_{dateyearmonthday}.pdf")
+
+        if createPdf:
+            # Selenium 4 helper returns a dict with a base‑64‑encoded PDF.
+            try:
+                starttime = time.time()
+                with profiling.stage("pdf_print"):
+                    pdf_bytes = driver.print_page(
+                        {
+                            "landscape": True,
+                            "displayHeaderFooter": True,
+                            "printBackground": True,
+                            "preferCSSPageSize": False,
+                            "shrinkToFit": True,
+                            'paper_width': '46.81', 'paper_height': '33.11',
+                        }
+                    )
+                # `pdf_bytes` is already a binary blob (bytes), replacing the file only once it is complete on disk
+                with atomicfile.writer(fullpdfname, "wb") as f:
+                    f.write(pdf_bytes)
+                if manifest is not None:
+                    manifest.record_artifact(g["dlurl"], "pdf", fullpdfname)
+                checkpoint_piece(manifest, g["dlurl"], "pdf")
+                events.info("PDF created: " + fullpdfname, event="pdf", path=fullpdfname, size=len(pdf_bytes), seconds=round(time.time() - starttime, 3))
+            except Exception as error:
+                events.exception("Error while writing file: " + fullpdfname)
+    except:
+        events.exception("Could not export the product page: " + URL)
+    finally:
+        browsers.release(driver)
+
+def download_product_videos(g, URL, download_dir, gamedirectory, manifest=None):
+    # videos embedded in the product page (youtube, vimeo, etc)
+    import yt_dlp
+
+    ydl_opts = {
+        'ignoreerrors': True,
+        'outtmpl': os.path.join(download_dir, gamedirectory + "_" + '%(id)s.%(ext)s'),
+        'logger': ydLogger(),
+        'progress_hooks': [yd_hook],
+    }
+    if bandwidthLimiter is not None and bandwidthLimiter.active():
+        ydl_opts['progress_hooks'].append(yd_bandwidth_hook())
+        if bandwidthLimiter.current_rate() > 0:
+            ydl_opts['ratelimit'] = bandwidthLimiter.current_rate()
+    if manifest is not None:
+        ydl_opts['postprocessor_hooks'] = [yd_record_hook(manifest, g["dlurl"])]
+
+    if config["DEFAULT"]["debug_logs"] == "ON": 
+        events.debug("Downloading page: {}".format(URL))
+
+    res = requests.get(URL)
+
+    if config["DEFAULT"]["debug_logs"] == "ON": 
+        events.debug(f"Got back response: {res.status_code}")
+        events.debug(f"Page length: {len(res.text)}")
+
+    pageHtml = res.text
+    for raw_src in pageparse.parse_iframes(pageHtml):
+        # e.g. "https://itch.io/embed/3347678?... "
+        # Normalise the URL:
+        if raw_src.startswith("//"):                 # protocol‑relative URLs (//domain/…)
+            video_url = "https:" + raw_src
+        elif raw_src.startswith("http://") or raw_src.startswith("https://"):
+            video_url = raw_src                      # already a full URL – keep it as‑is
+        else:                                        # fallback – assume HTTPS
+            video_url = "https://" + raw_src.lstrip("/")
+
+        events.info(f"Found video URL: {video_url}")
+        if piece_done(manifest, g["dlurl"], "video:" + video_url) is not None:
+            events.info("Video already downloaded by the interrupted run. Skipped.", event="capture_skip", kind="video", reason="checkpoint", url=video_url)
+            continue
+
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with profiling.stage("ytdlp"):
+                error_code = ydl.download(video_url)
+        if error_code == 0:
+            checkpoint_piece(manifest, g["dlurl"], "video:" + video_url)
+
+def finish_items(pending, manifest, cookiejar, browsers, wait=False, failed=None):
+    # completes the items at the head of the queue whose uploads are done (all of them if wait is true).
+    # items with an upload that could not be downloaded are added to failed, for a later retry pass
+    while pending and (wait or all(f.done() for f in pending[0][3])):
+        curGame, g, gamedirectory, futures, started = pending.popleft()
+        newDownloads = False
+        itemFailed = False
+        for future in futures:
+            try:
+                if future.result():
+                    newDownloads = True
+            except Exception as error:
+                itemFailed = True
+                events.error("{}: {}".format(slugify(g["title"]), error))
+        if itemFailed:
+            events.emit("item_end", "DEBUG", item=g["dlurl"], title=slugify(g["title"]), result="failed", seconds=round(time.time() - started, 3))
+            release_item(gamedirectory)
+            if failed is not None:
+                failed.append(g)
+            continue
+
+        if pageCaptures is None:
+            complete_item(g, gamedirectory, newDownloads, cookiejar, browsers, manifest, started)
+        else:
+            # one capture per browser of the pool at the same time, the main thread goes on with the next items
+            capturing.append((gamedirectory, pageCaptures.submit(complete_item, g, gamedirectory, newDownloads, cookiejar, browsers, manifest, started)))
+
+    # finished captures, an error of one ends the run as before
+    while capturing and (wait or capturing[0][1].done()):
+        capturing.popleft()[1].result()
+
+def complete_item(g, gamedirectory, newDownloads, cookiejar, browsers, manifest, started):
+    # product page capture of an item whose uploads are all downloaded, then the item is recorded as synced
+    try:
+        capture_product_page(g, gamedirectory, newDownloads, cookiejar, browsers, manifest)
+    finally:
+        release_item(gamedirectory)
+
+    # the item is done, an interrupted run will not process it again
+    manifest.mark_purchase_synced(g["dlurl"])
+    manifest.clear_checkpoints(g["dlurl"])
+    count_progress("synced")
+    if profiling.profiler.enabled:
+        profiling.profiler.record("item", time.time() - started)
+    events.emit("item_end", "DEBUG", item=g["dlurl"], title=slugify(g["title"]), result="synced", new_downloads=newDownloads,
+                seconds=round(time.time() - started, 3))
+
+def item_download_params(g, page):
+    # url, POST parameters and CSRF token to ask for the download JSON of the uploads of an item
+    dlurl = g['dlurl'].rsplit("/", 2)[0]
+    paramPost = {"source": "game_download", "key": g["dlurl"].split("/")[5]}
+    return dlurl, paramPost, page["csrf_token"]
+
+def item_number(curGame, numGames):
+    # "3 of 120", just "3" while the number of items is not known (first run, the listing is still being loaded)
+    if numGames is None:
+        return str(curGame)
+    return "{} of {}".format(curGame, numGames)
+
+def process_item(g, curGame, numGames, session, scheduler, manifest, dedup, pending, failed):
+    # loads the download page of an item and submits its uploads, the item is queued in pending until they are done
+    gamedirectory = g["dlurl"].split("/")[3]
+    print("")
+    if itemLeases is not None and not itemLeases.acquire(gamedirectory):
+        events.info("Item {} is being downloaded by another worker. Skipped. Title: ".format(item_number(curGame, numGames)) + slugify(g["title"]),
+                    event="item_skip", item=g["dlurl"], reason="leased")
+        count_progress("leased")
+        return
+    events.info("Analysing item {}. Title: ".format(item_number(curGame, numGames)) + slugify(g["title"]), event="item_start", item=g["dlurl"], number=curGame)
+    started = time.time()
+
+    try:
+        with profiling.stage("item_page"):
+            r = session.get(g["dlurl"])
+    except requests.RequestException as error:
+        # the session already retried, the item gets another chance in the retry pass
+        events.error(f"Could not access download page {g['dlurl']}: {error}")
+        release_item(gamedirectory)
+        failed.append(g)
+        return
+    if r.status_code == 200:
+
+        with profiling.stage("item_parse"):
+            page = pageparse.parse_item_page(r.text)
+        dlurl, paramPost, csfrToken = item_download_params(g, page)
+        uploads = page["uploads"]
+
+        # items sharing a game directory (the same game owned twice, or two authors with the same slug) would write
+        # the same .incomplete files, the uploads of this one wait until the other item's are done
+        busy = [f for entry in pending if entry[2] == gamedirectory for f in entry[3] if not f.done()]
+        busy = busy + [f for directory, f in capturing if directory == gamedirectory and not f.done()]
+        if busy:
+            events.debug("Waiting for another item downloading to {}".format(gamedirectory), event="item_wait", item=g["dlurl"])
+            wait_futures(busy)
+
+        futures = []
+        fileNr = 1
+        for u in uploads:
+            if config["DEFAULT"]["debug_logs"] == "ON":
+                events.debug("fetch_upload - " + "u: " + str(u) + ". durl: " + str(dlurl) + ". session: " + str(session) + ". paramPost: " + str(paramPost) + ". csfrToken: " + str(csfrToken) + ". gamedirectory: " + str(gamedirectory) + ". fileNr: " + str(fileNr))
+            futures.append(scheduler.submit(checkpointed_upload, u, dlurl, session, paramPost, csfrToken, gamedirectory, fileNr, page=page, scheduler=scheduler, manifest=manifest, itemurl=g["dlurl"], dedup=dedup))
+            fileNr = fileNr + 1
+
+        pending.append((curGame, g, gamedirectory, futures, started))
+
+    else:
+        tempUrl = g["dlurl"]
+        events.error(f"Could not access download page {tempUrl}")
+        release_item(gamedirectory)
+        if r.status_code in retry.RETRY_STATUS:
+            failed.append(g)
+
+def plan_upload(uploads_soup, dlurl, session, params, csfrtoken, gamedirectory, fileNr, page, manifest):
+    # remote metadata and planned action of an upload, nothing is written but the metadata kept in the manifest for the following run
+    key = upload_identity(uploads_soup, gamedirectory, fileNr)[0]
+    dlurl, downloadid = find_upload_link(uploads_soup, dlurl, page)
+    if dlurl is None:
+        return None
+    dlj = get_download_json(dlurl, session, params, csfrtoken, downloadid)
+    domain = dlj["url"].split("/")[2]
+    fulldldir = os.path.join(config["DEFAULT"]["download_directory"], gamedirectory)
+
+    if is_mirror_domain(domain):
+        # signed urls only answer a GET, the body is not read
+        with session.get(dlj["url"], stream=True) as response:
+            headers = response.headers
+        dlfilename = dltool.remote_filename(dlj["url"], headers)
+        path = os.path.join(fulldldir, dlfilename)
+    elif is_cdn_domain(domain):
+        dldate, dlfilename, _, headers = head_remote_file(session, dlj["url"])
+        oldname, newname = versioned_filenames(fileNr, dlfilename, dldate)
+        path = os.path.join(fulldldir, newname)
+        # a file of the old format is renamed by the download and then compared
+        if not os.path.isfile(path) and os.path.isfile(os.path.join(fulldldir, oldname)):
+            path = os.path.join(fulldldir, oldname)
+    else:
+        return {"action": plan.UNKNOWN, "size": None, "transfer": 0, "path": dlj["url"].split("?")[0]}
+
+    if not headers.get("content-length") or not headers.get("last-modified"):
+        return {"action": plan.UNKNOWN, "size": None, "transfer": 0, "path": path}
+    size = int(headers["content-length"])
+    action = plan.local_action(path, size, headers["last-modified"], manifest.upload(key))
+    manifest.record_remote_file(key, dlfilename, path, size, headers["last-modified"])
+    if config["DEFAULT"]["debug_logs"] == "ON":
+        events.debug(f"Plan: {action}, {size} bytes: {path}")
+    return {"action": action, "size": size, "transfer": plan.bytes_to_fetch(action, size, path, headers), "path": path}
+
+def plan_item(g, session, manifest, executor):
+    # loads the download page of an item and plans its uploads on executor, returns their futures
+    with profiling.stage("item_page"):
+        r = session.get(g["dlurl"])
+    if r.status_code != 200:
+        raise IOError("Could not access download page {} [{}]".format(g["dlurl"], r.status_code))
+    with profiling.stage("item_parse"):
+        page = pageparse.parse_item_page(r.text)
+    dlurl, paramPost, csfrToken = item_download_params(g, page)
+    gamedirectory = g["dlurl"].split("/")[3]
+    return [executor.submit(plan_upload, u, dlurl, session, paramPost, csfrToken, gamedirectory, fileNr, page, manifest)
+            for fileNr, u in enumerate(page["uploads"], 1)]
+
+def run_plan(session, manifest, gamelist, recheckSince):
+    # dry run: the download JSON and the remote metadata of every upload are fetched concurrently,
+    # then the bytes to download are printed per item and in total
+    workers = max(1, config["DEFAULT"].getint("plan_workers"))
+    syncplan = plan.SyncPlan()
+    # item pages and uploads have their own pools, an item waiting for its uploads cannot hold up the uploads
+    pages = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="plan-pages")
+    uploads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="plan")
+    items = []
+    try:
+        for g in gamelist:
+            if manifest.purchase_synced_since(g["dlurl"], recheckSince):
+                syncplan.add_recent()
+                continue
+            items.append((g, pages.submit(plan_item, g, session, manifest, uploads)))
+
+        for g, future in items:
+            try:
+                futures = future.result()
+            except Exception as error:
+                events.error(f"Plan: {slugify(g['title'])}: {error}")
+                continue
+            results = []
+            for upload in futures:
+                try:
+                    result = upload.result()
+                except Exception as error:
+                    result = {"action": plan.UNKNOWN, "size": None, "transfer": 0, "path": f"{g['dlurl']} ({error})"}
+                if result is not None:
+                    results.append(result)
+            syncplan.add_item(slugify(g["title"]), results)
+    finally:
+        pages.shutdown(wait=True, cancel_futures=True)
+        uploads.shutdown(wait=True, cancel_futures=True)
+    syncplan.print_totals()
+    return syncplan
+
+def read_purchases_page(html):
+    # returns the items of a my-purchases page and true if there is a next page, the page is parsed once
+    items = []
+    pageItems, hasNextPage = pageparse.parse_purchases_page(html)
+    for gtitle, gurl in pageItems:
+        gtitle = slugify(gtitle)
+        if config["DEFAULT"]["debug_logs"] == "ON": 
+            events.debug("Item found - " + "Title: " + gtitle + ". url: " + gurl)
+        items.append(
+            {
+                "title": slugify(gtitle),
+                "dlurl": gurl
+            }
+        )
+
+    return items, hasNextPage
+
+def load_purchases_page(session, mypurchases_url, pagecounter):
+    # returns items, next page flag and false if the page could not be loaded
+    with profiling.stage("listing_page"):
+        r = session.get(mypurchases_url + "?page={}".format(pagecounter))
+    if r.status_code != 200:
+        events.error(f"Could not load page {pagecounter} of {mypurchases_url} [{r.status_code}]")
+        return [], False, False
+    if config["DEFAULT"]["debug_logs"] == "ON":
+        events.debug(f"Loaded page {pagecounter} of {mypurchases_url}")
+    items, hasNextPage = read_purchases_page(r.text)
+    return items, hasNextPage, True
+
+def iter_purchase_pages(session, mypurchases_url, r, window=4):
+    # yields (items, loaded) page by page, r is the first page. the following pages are loaded in parallel,
+    # window pages ahead, and the walk stops at the first page without items or without a next page
+    items, hasNextPage = read_purchases_page(r.text)
+    yield items, True
+    if not hasNextPage or not items:
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max(1, window), thread_name_prefix="listing")
+    futures = collections.deque()
+    pagecounter = 2
+    try:
+        while True:
+            while len(futures) < max(1, window):
+                futures.append(executor.submit(load_purchases_page, session, mypurchases_url, pagecounter))
+                pagecounter = pagecounter + 1
+            items, hasNextPage, loaded = futures.popleft().result()
+            yield items, loaded
+            if not loaded or not hasNextPage or not items:
+                return
+    finally:
+        # pages loaded speculatively past the end (or past the known items) are dropped
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+def iter_purchases(session, mypurchases_url, r, manifest, full_refresh=False, window=4):
+    # yields the items to process while my-purchases is still being loaded: first the items of the refreshed pages,
+    # then the cached ones. newest purchases come first, so unless full_refresh is set paging stops at the first
+    # page where every item is already in the manifest
+    found = []
+    seen = set()
+    numNew = 0
+    complete = True
+    for items, loaded in iter_purchase_pages(session, mypurchases_url, r, window):
+        if not loaded:
+            complete = False
+            break
+        allKnown = True
+        for item in items:
+            if not manifest.is_listed(item["dlurl"]):
+                allKnown = False
+                numNew = numNew + 1
+            if item["dlurl"] not in seen:
+                seen.add(item["dlurl"])
+                found.append(item)
+                yield item
+        if not full_refresh and items and allKnown:
+            break
+
+    # items missing from an incomplete full refresh are kept
+    manifest.update_listing(found, full_refresh and complete)
+    gamelist = manifest.listed_purchases()
+    events.info("Purchases loaded: {} items found, {} new.".format(len(gamelist), numNew))
+
+    for item in gamelist:
+        if item["dlurl"] not in seen:
+            yield item
+
+def main(config, args):
+    # log lines and measurements go to the console and, if enabled, to a JSON-lines file in the download directory
+    # (the workers of a sharded run write one file each)
+    eventlog = None
+    if config["DEFAULT"]["event_log"] == "ON":
+        os.makedirs(config["DEFAULT"]["download_directory"], exist_ok=True)
+        eventname = "itch-batch-downloader-events.jsonl"
+        if args.shard is not None:
+            eventname = "itch-batch-downloader-events-shard-{}-of-{}.jsonl".format(*args.shard)
+        eventlog = os.path.join(config["DEFAULT"]["download_directory"], eventname)
+    events.configure(eventlog, debugon=config["DEFAULT"]["debug_logs"] == "ON")
+
+    events.info("Download directory is '{}'".format(config["DEFAULT"]["download_directory"]))
+    if args.shard is not None:
+        events.info("Worker {} of {}: downloading its share of the items".format(*args.shard), event="shard", shard=shard.shard_label(args.shard))
+
+    if args.verify:
+        # only the local files are checked, itch.io is not contacted
+        manifest = open_manifest()
+        try:
+            report = verify.verify_downloads(manifest, config["DEFAULT"]["download_directory"], workers=config["DEFAULT"].getint("verify_processes") or None,
+                                             fast_hash=fast_hash_setting(), debugon=config["DEFAULT"]["debug_logs"] == "ON")
+        finally:
+            manifest.close()
+        sys.exit(1 if report["corrupt"] or report["missing"] else 0)
+
+    if args.progress:
+        # counters of every worker of the download directory, from the manifest
+        manifest = open_manifest()
+        try:
+            print_progress(manifest)
+        finally:
+            manifest.close()
+        return
+
     time.sleep(3)
 
-    # basic setup
-    session = requests.Session()
+    # downloads and videos share one bandwidth limit, which may change with the time of day
+    global bandwidthLimiter
+    bandwidthLimiter = bandwidth.BandwidthLimiter(config["DEFAULT"].getint("bandwidth_limit_kbps") * 1024,
+                                                  bandwidth.parse_schedule(config["DEFAULT"]["bandwidth_schedule"]))
+    if not bandwidthLimiter.active():
+        bandwidthLimiter = None
+
+    # basic setup: every request waits for the rate limit of its host and is retried with backoff on errors, 429 and 5xx
+    session = retry.RetrySession(retry_policy(), retry.HostRateLimiter(config["DEFAULT"].getfloat("requests_per_second_per_host")),
+                                 (config["DEFAULT"].getfloat("connect_timeout_seconds"), config["DEFAULT"].getfloat("read_timeout_seconds")))
     cookiejar = requests.cookies.RequestsCookieJar()
 
     cookies = MozillaCookieJar(config["DEFAULT"]["cookie_file"])
@@ -310,288 +1001,231 @@ def main(config):
 
     session.cookies = cookiejar
 
+    # enough pooled connections for the parallel downloads and their segments
+    poolsize = config["DEFAULT"].getint("parallel_downloads") * max(1, config["DEFAULT"].getint("segmented_connections"))
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max(10, poolsize), pool_maxsize=max(10, poolsize))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
     os.makedirs(config["DEFAULT"]["download_directory"], exist_ok=True)
 
-    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] Loading and parsing my claimed purchases: ", end='')
-    mypurchases_url = "https://itch.io/my-purchases"
+    events.info("Loading and parsing my claimed purchases")
+    mypurchases_url = config["DEFAULT"]["itch_url"].rstrip("/") + "/my-purchases"
 
-    pagecounter = 1
-    gamelist = list()
-    r = session.get(mypurchases_url)
+    with profiling.stage("listing_page"):
+        r = session.get(mypurchases_url)
     if r.status_code == 200:
         if r.url != mypurchases_url:
-            print("") # carriage return
-            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} Not properly authenticated, please provide cookies.")
+            events.error("Not properly authenticated, please provide cookies.")
             sys.exit(1)
 
-        # parse first page
-        soup_gamepage = BeautifulSoup(r.text, "html.parser").find_all("div", class_="game_cell_data")
-        for game in soup_gamepage:
-            gtitle = slugify(game.find("a", class_="title game_link").text)
-            gurl = game.find("a", class_="button")["href"]
-            if config["DEFAULT"]["debug_logs"] == "ON": 
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] Item found - " + "Title: " + gtitle + ". url: " + gurl)
-            platform_soup = game.find("div", class_="game_platform")
-            gamelist.append(
-                {
-                    "title": slugify(gtitle),
-                    "dlurl": gurl
-                }
-            )
-
-        soup_nextpage = BeautifulSoup(r.text, "html.parser").find("div", attrs={"class": "next_page forward_link"})
-        while soup_nextpage:
-            pagecounter = pagecounter + 1
-            print(".", flush=True, end="")
-
-            r = session.get(mypurchases_url + "?page={}".format(pagecounter))
-            if r.status_code != 200:
-                print(" [{}]".format(pagecounter), flush=True)
-                break
-
-            soup_gamepage = BeautifulSoup(r.text, "html.parser").find_all("div", class_="game_cell_data")
-            for game in soup_gamepage:
-                gtitle = slugify(game.find("a", class_="title game_link").text)
-                gurl = game.find("a", class_="button")["href"]
-                if config["DEFAULT"]["debug_logs"] == "ON": 
-                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] Item found - " + "Title: " + gtitle + ". url: " + gurl)
-                platform_soup = game.find("div", class_="game_platform")
-                gamelist.append(
-                    {
-                        "title": slugify(gtitle),
-                        "dlurl": gurl
-                    }
-                )
-
-            soup_nextpage = BeautifulSoup(r.text, "html.parser").find("div", attrs={"class": "next_page forward_link"})
-
-        print("")  # carriage return
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] {} items found.".format(len(gamelist)))
+        manifest = open_manifest()
+
+        # identical uploads of different items are stored once and linked into each game directory
+        dedup = None
+        if config["DEFAULT"]["dedup"] == "ON":
+            dedup = DedupStore(os.path.join(config["DEFAULT"]["download_directory"], ".dedup"), manifest, debugon=config["DEFAULT"]["debug_logs"] == "ON")
+
+        # the purchase list is cached in the manifest, only the pages with new items are loaded again.
+        # items are handed over while the pages are loaded, so the downloads start with the first page
+        # a worker of a sharded run only sees its share of the items
+        fullRefresh = args.full_refresh or not manifest.listed_purchases()
+        # the total comes from the cached list, there is none before the first listing is complete
+        numGames = len([g for g in manifest.listed_purchases() if shard.in_shard(g, args.shard)]) or None
+        gamelist = iter_purchases(session, mypurchases_url, r, manifest, fullRefresh, config["DEFAULT"].getint("listing_pages_ahead"))
+        gamelist = (g for g in gamelist if shard.in_shard(g, args.shard))
+        # each worker continues its own interrupted run
+        runKey = "run_started" if args.shard is None else "run_started:" + shard.shard_label(args.shard)
+
+        if args.plan:
+            # nothing is downloaded, the remote metadata is kept in the manifest for the run that follows
+            runStarted = manifest.get_state(runKey)
+            recheckSince = min(float(runStarted) if runStarted is not None else time.time(),
+                               time.time() - config["DEFAULT"].getfloat("manifest_recheck_hours") * 3600)
+            try:
+                run_plan(session, manifest, gamelist, recheckSince)
+            finally:
+                manifest.close()
+            return
 
+        # trackfile of older versions, honoured once and replaced by the manifest
+        # (claimed by renaming it, so only one worker reads it. its position counts all the items, a shard ignores it)
         trackfile = os.path.join(config["DEFAULT"]["download_directory"], "itch-batch-downloader-track.txt")
         trackNum = 0
-        if os.path.exists(trackfile):
-            with open(trackfile, "r", encoding="utf-8") as f:
-                trackNum = json.loads(f.read())
-            f.close()
-            os.remove(trackfile)
+        claimed = "{}.{}".format(trackfile, os.getpid())
+        try:
+            os.rename(trackfile, claimed)
+        except OSError:
+            claimed = None
+        if claimed is not None:
+            with open(claimed, "r", encoding="utf-8") as f:
+                if args.shard is None:
+                    trackNum = json.loads(f.read())
+            os.remove(claimed)
+
+        # an interrupted run is continued: items completed since it started are not processed again
+        runStarted = manifest.get_state(runKey)
+        if runStarted is None:
+            runStarted = time.time()
+            manifest.set_state(runKey, runStarted)
+        else:
+            runStarted = float(runStarted)
+            events.info("Continuing the run started on " + datetime.fromtimestamp(runStarted).strftime("%Y-%m-%d %H:%M:%S"))
+        recheckSince = min(runStarted, time.time() - config["DEFAULT"].getfloat("manifest_recheck_hours") * 3600)
+        # and of the items it did not complete, the uploads and page captures it finished are not done again
+        global checkpointSince
+        checkpointSince = runStarted
 
-        numGames = len(gamelist)
         curGame = 0
-                    
-        for g in gamelist:
-            curGame = curGame + 1
-            if curGame >= trackNum:
-                print("")
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] Analysing item {} of {}. Title: ".format(curGame, numGames) + slugify(g["title"]))
-
-                # trackfile
-                with open(trackfile, "w", encoding="utf-8") as f:
-                    json.dump(curGame, f)
-                f.close()
-
-                r = session.get(g["dlurl"])
-                if r.status_code == 200:
-
-                    dlpage_soup = BeautifulSoup(r.text, "html.parser")
-                    dlpage_dlbuttons = dlpage_soup.find_all("a", class_="button download_btn")
-                    dlurl = g['dlurl'].rsplit("/", 2)[0]
-                    gamedirectory = g["dlurl"].split("/")[3]
-                    paramPost = {"source": "game_download", "key": g["dlurl"].split("/")[5]}
-                    csfrToken = dlpage_soup.find("meta", attrs={"name": "csrf_token"})["value"]
-                    uploads = dlpage_soup.find("div", class_="upload_list_widget").find_all(class_="upload")
-                    newDownloads = False
-                    
-                    fileNr = 1
-                    for u in uploads:
-                        if config["DEFAULT"]["debug_logs"] == "ON": 
-                            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] fetch_upload - " + "u: " + str(u) + ". durl: " + str(dlurl) + ". session: " + str(session) + ". paramPost: " + str(paramPost) + ". csfrToken: " + str(csfrToken) + ". gamedirectory: " + str(gamedirectory) + ". fileNr: " + str(fileNr))
-                        newDownloadsTemp = fetch_upload(u, dlurl, session, paramPost, csfrToken, gamedirectory, fileNr, full_page_soup=dlpage_soup)
-                        fileNr = fileNr + 1
-                        if not newDownloads:
-                            newDownloads = newDownloadsTemp
-
-                    # product webpage screenshot is exported to image and PDF
-                    URL = "https://" + g["dlurl"].split("/")[2] + "/" + g["dlurl"].split("/")[3]
-                    
-                    now = datetime.now()
-                    dateyearmonthday = now.strftime("%Y%m%d")
-                    
-                    # selenium 4
-                    options = Options()
-                    options.add_experimental_option('excludeSwitches', ['enable-logging'])
-                    options.add_argument('--headless')
-                    options.add_argument('--disable-gpu')
-                    options.add_argument("--disable-3d-apis")
-                    options.add_argument('--no-sandbox')
-                    options.add_argument('--disable-dev-shm-usage')
-                    options.add_argument('--hide-scrollbars')
-                    options.add_argument('--disable-web-security')
-
-                    driver = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
-
-                    driver.cookies = cookiejar
-                    
-                    try:
-                        driver.get(URL)
-                    except:
-                        driver.get(URL, verify=False)
-                        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} Cannot verify domain, connection insicure")
-                        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                        traceback.print_exc()
-                        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
- 
-                    try:
-                        util.wait_until_images_loaded(driver, 30)
-                    except TimeoutException:
-                        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} Timeout error on: " + URL)
-                        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                        traceback.print_exc()
-                        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                                     
-                    try:
-
-                        height = 1024 + driver.execute_script("return document.documentElement.scrollHeight;")
-                        width = 1024 + driver.execute_script("return document.body.offsetWidth;")
-                        driver.set_window_size(width, height)
-                        driver.maximize_window()
-                            
-                        # product webpage screenshot is exported to image
-                        download_dir = os.path.join(os.path.abspath(config["DEFAULT"]["download_directory"]), gamedirectory)
-                        fullscrname = os.path.join(download_dir, gamedirectory + "_webpage_screenshot_" + dateyearmonthday + ".png")                      
-       
-                        if config["DEFAULT"]["debug_logs"] == "ON": 
-                            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + "Taking screenshot and creating PDF with Selenium, width: " + str(width) + ", height: " + str(height))
-                        
-                        try:
-                            dir_check = Path(download_dir)
-                            if not dir_check.is_dir():
-                                os.mkdir(download_dir)
-                            
-                            screenshotsFound = 0
-                            for name in glob.glob(os.path.join(download_dir, gamedirectory + "_webpage_screenshot_" + "*" + ".png")):
-                                screenshotsFound = screenshotsFound + 1
-
-                            if newDownloads or screenshotsFound <= 0:
-                                if config["DEFAULT"]["create_png"] == "ON":
-                                    debugon = True
-                                    util.fullpage_screenshot(driver, fullscrname, debugon)
-                                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] Screenshot taken: " + fullscrname)
-                                else:
-                                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] Screenshot creation disabled as config setting not equal to ON")
-                            else:
-                                if config["DEFAULT"]["create_png"] == "ON":
-                                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] Recent screenshot exists. Skipped.")
-                                else:
-                                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] Screenshot creation disabled as config setting not equal to ON")
-                        except:
-                            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} Error while writing file: " + fullscrname)
-                            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                            traceback.print_exc()
-                            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                            
-                        # product webpage screenshot is exported to pdf
-                        fullpdfname = os.path.join(download_dir, f"{gamedirectory}_webpage_screenshot_{dateyearmonthday}.pdf")                         
-                        
-                        try:
-                            
-                            pdfsFound = 0
-                            for name in glob.glob(os.path.join(download_dir, gamedirectory + "_webpage_screenshot_" + "*" + ".pdf")):
-                                pdfsFound = pdfsFound + 1 
-                            if newDownloads or pdfsFound <= 0:
-                              
-                                if config["DEFAULT"]["create_pdf"] == "ON": 
-                                    # Selenium 4 helper returns a dict with a base‑64‑encoded PDF.
-                                    try:
-                                        pdf_bytes = driver.print_page(
-                                            {
-                                                "landscape": True,
-                                                "displayHeaderFooter": True,
-                                                "printBackground": True,
-                                                "preferCSSPageSize": False,
-                                                "shrinkToFit": True,
-                                                'paper_width': '46.81', 'paper_height': '33.11',
-                                            }
-                                        )
-                                        # `pdf_bytes` is already a binary blob (bytes) – write it straight to disk.
-                                        with open(fullpdfname, "wb") as f:
-                                            f.write(pdf_bytes)
-                                        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] PDF created: " + fullpdfname)
-                                    except Exception as error:
-                                        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[ERROR] " + "PDF generation get response: ")
-                                        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                                        traceback.print_exc()
-                                        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                                elif config["DEFAULT"]["debug_logs"] == "ON":
-                                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] PDF creation disabled as config setting not equal to ON")
-                            else:
-                                if config["DEFAULT"]["create_pdf"] == "ON":
-                                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] Recent PDF exists. Skipped.")
-                                else:
-                                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] PDF creation disabled as config setting not equal to ON")
-                        except:
-                            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} Error while writing file: " + fullpdfname)
-                            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                            traceback.print_exc()
-                            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} =====================================")
-                            
-                        # product videos are downloaded (youtube, vimeo, etc)  
-                        if config["DEFAULT"]["download_videos"] == "ON": 
-  
-                            ydl_opts = {
-                                'ignoreerrors': True,
-                                'outtmpl': os.path.join(download_dir, gamedirectory + "_" + '%(id)s.%(ext)s'),
-                                'logger': ydLogger(),
-                                'progress_hooks': [yd_hook],
-                            }
-                
-                            if config["DEFAULT"]["debug_logs"] == "ON": 
-                                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + "Downloading page: {}".format(URL))
-                            
-                            res = requests.get(URL)
-
-                            if config["DEFAULT"]["debug_logs"] == "ON": 
-                                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + f"Got back response: {res.status_code}")
-                                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + f"Page length: {len(res.text)}")
-
-                            pageHtml = res.text
-                            bsParser = BeautifulSoup(pageHtml, features='html.parser')
-                            hrefs = bsParser.find_all('iframe')
-                            for href in hrefs:
-                                raw_src = href.get("src")                # e.g. "https://itch.io/embed/3347678?... "
-                                # Normalise the URL:
-                                if raw_src.startswith("//"):                 # protocol‑relative URLs (//domain/…)
-                                    video_url = "https:" + raw_src
-                                elif raw_src.startswith("http://") or raw_src.startswith("https://"):
-                                    video_url = raw_src                      # already a full URL – keep it as‑is
-                                else:                                        # fallback – assume HTTPS
-                                    video_url = "https://" + raw_src.lstrip("/")
-
-                                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"[INFO] Found video URL: {video_url}")
-
-                                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                                    error_code = ydl.download(video_url)
-                                    
-                        else:
-                        
-                            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] Video downloads disabled as config setting not equal to ON")
-
-                    finally:
-                        newDownloads = False
-                        driver.quit()
 
+        # uploads run on the worker pool, the product page capture of an item happens once all its uploads are done
+        scheduler = dlscheduler.DownloadScheduler(
+            workers=config["DEFAULT"].getint("parallel_downloads"),
+            per_host=config["DEFAULT"].getint("parallel_downloads_per_host"),
+        )
+        browsers = BrowserPool(
+            size=config["DEFAULT"].getint("browser_pool_size"),
+            recycle_after=config["DEFAULT"].getint("browser_recycle_pages"),
+            debugon=config["DEFAULT"]["debug_logs"] == "ON",
+        )
+        global pageCaptures
+        pageCaptures = ThreadPoolExecutor(max_workers=browsers.size, thread_name_prefix="capture")
+        # workers sharing the download directory never write the same game directory at the same time
+        global itemLeases, shardProgress
+        itemLeases = shard.LeaseDirectory(os.path.join(config["DEFAULT"]["download_directory"], ".leases"),
+                                          ttl=config["DEFAULT"].getint("lease_minutes") * 60)
+        shardProgress = shard.Progress(manifest, shard.shard_label(args.shard))
+        pending = collections.deque()
+        failed = []
+        try:
+            for g in gamelist:
+                curGame = curGame + 1
+                if numGames is not None:
+                    numGames = max(numGames, curGame)
+                count_progress("items")
+                if curGame < trackNum:
+                    pass
+                elif manifest.purchase_synced_since(g["dlurl"], recheckSince):
+                    events.debug("Item {} synced recently. Skipped. Title: ".format(item_number(curGame, numGames)) + slugify(g["title"]),
+                                 event="item_skip", item=g["dlurl"], reason="recent")
+                    count_progress("recent")
                 else:
-                    tempUrl = g["dlurl"]
-                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} Could not access download page {tempUrl}")
-                    
-        # trackfile
-        with open(trackfile, "w", encoding="utf-8") as f:
-            json.dump(0, f)
-        f.close()
+                    process_item(g, curGame, numGames, session, scheduler, manifest, dedup, pending, failed)
+
+                finish_items(pending, manifest, cookiejar, browsers, wait=False, failed=failed)
+
+            finish_items(pending, manifest, cookiejar, browsers, wait=True, failed=failed)
+
+            # items that failed are tried once more at the end of the run, when the server may be reachable again
+            if failed:
+                retryItems = list(failed)
+                del failed[:]
+                print("")
+                events.info("Retrying {} items that failed".format(len(retryItems)))
+                for retryNum, g in enumerate(retryItems, 1):
+                    process_item(g, retryNum, len(retryItems), session, scheduler, manifest, dedup, pending, failed)
+                    finish_items(pending, manifest, cookiejar, browsers, wait=False, failed=failed)
+                finish_items(pending, manifest, cookiejar, browsers, wait=True, failed=failed)
+            for g in failed:
+                events.error("Not downloaded, it will be tried again on the next run: " + slugify(g["title"]))
+                count_progress("failed")
+        finally:
+            scheduler.shutdown(wait=True)
+            pageCaptures.shutdown(wait=True, cancel_futures=True)
+            browsers.close()
+            itemLeases.close()
+
+        # run completed, the next one starts from the first item
+        shardProgress.save(finished=True)
+        manifest.delete_state(runKey)
+        manifest.close()
     else:
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + f"{Fore.RED}[ERROR]{Style.RESET_ALL} Could not access {mypurchases_url} properly [{r.status_code}]")
+        events.error(f"Could not access {mypurchases_url} properly [{r.status_code}]")
+
+def print_progress(manifest):
+    # items seen, synced, skipped as recent, left to another worker and failed, per worker and in total
+    rows, totals = shard.combined_progress(manifest)
+    if not rows:
+        events.info("No progress recorded yet")
+        return
+    print("{:<10} {:<24} {:>7} {:>7} {:>7} {:>7} {:>7}  {}".format("worker", "host", *shard.COUNTS, "state"))
+    for worker, record in rows:
+        if record.get("finished"):
+            state = "finished " + datetime.fromtimestamp(record["updated"]).strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            state = "running, updated {} s ago".format(int(time.time() - record["updated"]))
+        print("{:<10} {:<24} {:>7} {:>7} {:>7} {:>7} {:>7}  {}".format(
+            worker, "{}:{}".format(record["host"], record["pid"])[:24], *[record.get(name, 0) for name in shard.COUNTS], state))
+    print("{:<10} {:<24} {:>7} {:>7} {:>7} {:>7} {:>7}".format("total", "", *[totals[name] for name in shard.COUNTS]))
+
+def default_config():
+    # settings used where the config file has none
+    return {
+        "download_directory": "Downloads",
+        "cookie_file": "cookies-itch.txt",
+        "create_pdf": "ON",
+        "create_png": "ON",
+        "download_videos": "ON",
+        "debug_logs": "OFF",
+        "parallel_downloads": "4",
+        "parallel_downloads_per_host": "2",
+        "segmented_connections": "4",
+        "segmented_threshold_mb": "512",
+        "download_chunk_kb": "1024",
+        "write_buffer_kb": "1024",
+        "preallocate_downloads": "ON",
+        "fsync_downloads": "OFF",
+        "fsync_interval_mb": "0",
+        "dedup": "OFF",
+        "fast_hash": "OFF",
+        "verify_processes": "0",
+        "retry_attempts": "5",
+        "retry_backoff_seconds": "2",
+        "requests_per_second_per_host": "5",
+        "connect_timeout_seconds": "10",
+        "read_timeout_seconds": "60",
+        "bandwidth_limit_kbps": "0",
+        "bandwidth_schedule": "",
+        "plan_workers": "8",
+        "plan_reuse_minutes": "60",
+        "event_log": "OFF",
+        "itch_url": "https://itch.io",
+        "cdn_hosts": "w3g3a5v6.ssl.hwcdn.net",
+        "mirror_hosts": "cloudflarestorage.com, itchio-mirror",
+        "manifest_recheck_hours": "24",
+        "manifest_wal": "ON",
+        "lease_minutes": "10",
+        "listing_pages_ahead": "4",
+        "browser_pool_size": "1",
+        "browser_recycle_pages": "50",
+        "screenshot_mode": "stream"
+    }
+
+def argument_parser():
+    # command line options
+    parser = argparse.ArgumentParser(description="Downloads all the items bound to your itch.io account")
+    parser.add_argument("--full-refresh", action="store_true", help="load every page of my-purchases again instead of only the ones with new items")
+    parser.add_argument("--verify", action="store_true", help="hash the downloaded files again and report corrupt, missing and unknown files, without downloading")
+    parser.add_argument("--plan", action="store_true", help="show how many bytes a sync would download, skip and replace by a new version, without downloading")
+    parser.add_argument("--shard", type=shard.parse_shard, metavar="I/N",
+                        help="worker I of N sharing the download directory: only its share of the items is downloaded, e.g. --shard 1/3")
+    parser.add_argument("--progress", action="store_true", help="show the progress of every worker of the download directory, without downloading")
+    parser.add_argument("--profile", nargs="?", const="itch-batch-downloader.prof", metavar="FILE",
+                        help="time the stages of the run, print a report at the end and write a cProfile dump to FILE (default itch-batch-downloader.prof)")
+    return parser
+
+def write_profile(path):
+    # stops the profiler, writes the cProfile dump and prints the stage timings
+    profiling.profiler.disable()
+    print("")
+    print(profiling.profiler.report())
+    if profiling.profiler.dump(path):
+        events.info("Profile written to {}, open it with pstats or snakeviz".format(path), event="profile", path=path)
 
 if __name__ == "__main__":
+    # the --verify worker processes of the PyInstaller exe start here too, they must hash instead of running the downloader
+    multiprocessing.freeze_support()
+
     print("itch-batch-downloader.py {} (c) 2022 mukkino".format(version))
     print("")
 
@@ -599,26 +1233,27 @@ if __name__ == "__main__":
 
     # initialize and load defaults
     configfile = "itch-batch-downloader.ini"
-    config['DEFAULT'] = {
-        "download_directory": "Downloads",
-        "cookie_file": "cookies-itch.txt",
-        "create_pdf": "ON",
-        "create_png": "ON",
-        "download_videos": "ON",
-        "debug_logs": "OFF"
-    }
+    config['DEFAULT'] = default_config()
 
     if not os.path.isfile(configfile):
         with open(configfile, "w", encoding="utf-8") as f:
             config.write(f)
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[INFO] Created new configuration. please edit {}".format(configfile))
+        events.info("Created new configuration. please edit {}".format(configfile))
         if sys.platform == "win32":
             x = input("Press ENTER to exit")
             sys.exit(1)
 
     config.read(configfile)
 
-    main(config)
+    args = argument_parser().parse_args()
+
+    if args.profile:
+        profiling.profiler.enable()
+    try:
+        main(config, args)
+    finally:
+        if args.profile:
+            write_profile(args.profile)
     
     newDownloads = 0
 
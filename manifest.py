@@ -0,0 +1,284 @@
+# local sync manifest: purchases, uploads and page artifacts (png, pdf, videos) downloaded so far
+
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS purchases (
+    dlurl TEXT PRIMARY KEY,
+    title TEXT,
+    gamedirectory TEXT,
+    first_seen REAL,
+    synced_at REAL,
+    sort_key REAL,
+    listed INTEGER DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    upload_key TEXT PRIMARY KEY,
+    dlurl TEXT,
+    upload_id TEXT,
+    remote_filename TEXT,
+    size INTEGER,
+    last_modified TEXT,
+    local_path TEXT,
+    sha256 TEXT,
+    fast_hash TEXT,
+    synced_at REAL
+);
+CREATE INDEX IF NOT EXISTS uploads_dlurl ON uploads (dlurl);
+CREATE TABLE IF NOT EXISTS artifacts (
+    local_path TEXT PRIMARY KEY,
+    dlurl TEXT,
+    kind TEXT,
+    size INTEGER,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS artifacts_dlurl ON artifacts (dlurl, kind);
+CREATE TABLE IF NOT EXISTS contents (
+    sha256 TEXT,
+    size INTEGER,
+    local_path TEXT,
+    created_at REAL,
+    PRIMARY KEY (sha256, size)
+);
+CREATE TABLE IF NOT EXISTS remote_files (
+    upload_key TEXT PRIMARY KEY,
+    remote_filename TEXT,
+    local_path TEXT,
+    size INTEGER,
+    last_modified TEXT,
+    checked_at REAL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    dlurl TEXT,
+    piece TEXT,
+    result INTEGER,
+    done_at REAL,
+    PRIMARY KEY (dlurl, piece)
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class Manifest:
+    """
+    SQLite database kept in the download directory, shared by the download workers and by the processes of a sharded run
+    @params:
+        path        - Required  : database file (Str)
+        wal         - Optional  : write-ahead log, readers and the writer of other processes do not block each other (Bool)
+        timeout     - Optional  : seconds a write waits for another process holding the database (Float)
+    """
+
+    def __init__(self, path, wal=False, timeout=60):
+        self.path = path
+        self._lock = threading.RLock()
+        # write transactions take the write lock when they begin, so a busy database is waited for instead of failing halfway
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level="IMMEDIATE")
+        self._db.row_factory = sqlite3.Row
+        if wal:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+            self._add_column("purchases", "sort_key", "REAL")
+            self._add_column("purchases", "listed", "INTEGER DEFAULT 1")
+            self._add_column("uploads", "fast_hash", "TEXT")
+
+    def _add_column(self, table, column, decl):
+        # databases created by older versions
+        columns = [row["name"] for row in self._db.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _write(self, sql, params=()):
+        with self._lock, self._db:
+            self._db.execute(sql, params)
+
+    # run state (replaces itch-batch-downloader-track.txt)
+    def get_state(self, key, default=None):
+        rows = self._query("SELECT value FROM state WHERE key = ?", (key,))
+        if not rows:
+            return default
+        return rows[0]["value"]
+
+    def set_state(self, key, value):
+        self._write("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def delete_state(self, key):
+        self._write("DELETE FROM state WHERE key = ?", (key,))
+
+    def states(self, prefix):
+        # (key, value) of the keys starting with prefix
+        rows = self._query("SELECT key, value FROM state WHERE substr(key, 1, ?) = ? ORDER BY key", (len(prefix), prefix))
+        return [(row["key"], row["value"]) for row in rows]
+
+    # purchases
+    def record_purchase(self, dlurl, title, gamedirectory):
+        self._write(
+            "INSERT INTO purchases (dlurl, title, gamedirectory, first_seen) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (dlurl) DO UPDATE SET title = excluded.title, gamedirectory = excluded.gamedirectory",
+            (dlurl, title, gamedirectory, time.time()),
+        )
+
+    def update_listing(self, items, full_refresh=False):
+        # items is the newest part of my-purchases (all of it if full_refresh), newest first.
+        # new items are put in front of the cached list, a full refresh also drops items no longer listed
+        with self._lock, self._db:
+            # other workers of a sharded run may update the list at the same time, the read belongs to the transaction
+            self._db.execute("BEGIN IMMEDIATE")
+            if full_refresh:
+                self._db.execute("UPDATE purchases SET listed = 0")
+                start = 0
+            else:
+                known = set(row["dlurl"] for row in self._db.execute("SELECT dlurl FROM purchases WHERE sort_key IS NOT NULL AND listed = 1"))
+                items = [i for i in items if i["dlurl"] not in known]
+                lowest = self._db.execute("SELECT MIN(sort_key) FROM purchases WHERE listed = 1").fetchone()[0]
+                start = (lowest or 0) - len(items)
+            for position, item in enumerate(items):
+                self._db.execute(
+                    "INSERT INTO purchases (dlurl, title, gamedirectory, first_seen, sort_key, listed) VALUES (?, ?, ?, ?, ?, 1) "
+                    "ON CONFLICT (dlurl) DO UPDATE SET title = excluded.title, sort_key = excluded.sort_key, listed = 1",
+                    (item["dlurl"], item["title"], item["dlurl"].split("/")[3], time.time(), start + position),
+                )
+
+    def listed_purchases(self):
+        # cached my-purchases list, in the order of the itch.io page
+        rows = self._query("SELECT dlurl, title FROM purchases WHERE listed = 1 AND sort_key IS NOT NULL ORDER BY sort_key")
+        return [{"title": row["title"], "dlurl": row["dlurl"]} for row in rows]
+
+    def is_listed(self, dlurl):
+        return bool(self._query("SELECT 1 FROM purchases WHERE dlurl = ? AND listed = 1 AND sort_key IS NOT NULL", (dlurl,)))
+
+    def purchase(self, dlurl):
+        rows = self._query("SELECT * FROM purchases WHERE dlurl = ?", (dlurl,))
+        return rows[0] if rows else None
+
+    def mark_purchase_synced(self, dlurl, when=None):
+        # the item may be done before the listing that has it is written, e.g. on a first run or by another worker
+        self._write(
+            "INSERT INTO purchases (dlurl, gamedirectory, first_seen, synced_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (dlurl) DO UPDATE SET synced_at = excluded.synced_at",
+            (dlurl, dlurl.split("/")[3], time.time(), when or time.time()),
+        )
+
+    def purchase_synced_since(self, dlurl, since):
+        # true if the item was completely downloaded at or after the timestamp since
+        row = self.purchase(dlurl)
+        return row is not None and row["synced_at"] is not None and row["synced_at"] >= since
+
+    # uploads
+    def upload(self, upload_key):
+        rows = self._query("SELECT * FROM uploads WHERE upload_key = ?", (upload_key,))
+        return rows[0] if rows else None
+
+    def uploads(self, dlurl):
+        return self._query("SELECT * FROM uploads WHERE dlurl = ?", (dlurl,))
+
+    def record_upload(self, upload_key, dlurl, upload_id, remote_filename, size, last_modified, local_path, sha256=None, fast_hash=None):
+        # the hashes of a skipped (unchanged) file are kept from the run that downloaded it.
+        # the file of an older version stays next to the new one, it is kept as an old_version artifact
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO artifacts (local_path, dlurl, kind, size, created_at) "
+                "SELECT local_path, dlurl, 'old_version', size, ? FROM uploads WHERE upload_key = ? AND local_path IS NOT NULL AND local_path != ?",
+                (time.time(), upload_key, local_path),
+            )
+            self._db.execute(
+                "INSERT INTO uploads (upload_key, dlurl, upload_id, remote_filename, size, last_modified, local_path, sha256, fast_hash, synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (upload_key) DO UPDATE SET dlurl = excluded.dlurl, upload_id = excluded.upload_id, "
+                "remote_filename = excluded.remote_filename, local_path = excluded.local_path, synced_at = excluded.synced_at, "
+                "sha256 = CASE WHEN excluded.sha256 IS NOT NULL THEN excluded.sha256 "
+                "WHEN uploads.size = excluded.size AND uploads.last_modified IS excluded.last_modified THEN uploads.sha256 END, "
+                "fast_hash = CASE WHEN excluded.sha256 IS NOT NULL THEN excluded.fast_hash "
+                "WHEN uploads.size = excluded.size AND uploads.last_modified IS excluded.last_modified THEN uploads.fast_hash END, "
+                "size = excluded.size, last_modified = excluded.last_modified",
+                (upload_key, dlurl, upload_id, remote_filename, size, last_modified, local_path, sha256, fast_hash, time.time()),
+            )
+
+    def all_uploads(self):
+        return self._query("SELECT * FROM uploads WHERE local_path IS NOT NULL ORDER BY local_path")
+
+    def set_upload_hashes(self, upload_key, sha256, fast_hash=None):
+        # files downloaded before the hashes were recorded get them on their first verification
+        self._write("UPDATE uploads SET sha256 = ?, fast_hash = COALESCE(?, fast_hash) WHERE upload_key = ?", (sha256, fast_hash, upload_key))
+
+    def upload_hashes(self, upload_id, size, last_modified):
+        # (sha256, fast hash) of an upload with the same id and version downloaded before, (None, None) if there is none
+        rows = self._query(
+            "SELECT sha256, fast_hash FROM uploads WHERE upload_id = ? AND size = ? AND last_modified = ? AND sha256 IS NOT NULL "
+            "ORDER BY fast_hash IS NULL LIMIT 1",
+            (upload_id, size, last_modified),
+        )
+        return (rows[0]["sha256"], rows[0]["fast_hash"]) if rows else (None, None)
+
+    # remote metadata prefetched by a plan (--plan), reused by the following run
+    def record_remote_file(self, upload_key, remote_filename, local_path, size, last_modified):
+        self._write(
+            "INSERT OR REPLACE INTO remote_files (upload_key, remote_filename, local_path, size, last_modified, checked_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (upload_key, remote_filename, local_path, size, last_modified, time.time()),
+        )
+
+    def remote_file(self, upload_key, since):
+        # metadata checked at or after the timestamp since, None if there is none
+        rows = self._query("SELECT * FROM remote_files WHERE upload_key = ? AND checked_at >= ?", (upload_key, since))
+        return rows[0] if rows else None
+
+    # pieces of an item finished by the current run (uploads, png, pdf, videos), so an interrupted item only does the rest again
+    def set_checkpoint(self, dlurl, piece, result=None):
+        self._write(
+            "INSERT OR REPLACE INTO checkpoints (dlurl, piece, result, done_at) VALUES (?, ?, ?, ?)",
+            (dlurl, piece, result, time.time()),
+        )
+
+    def checkpoint(self, dlurl, piece, since):
+        # row of the piece if it was finished at or after the timestamp since, None otherwise
+        rows = self._query("SELECT * FROM checkpoints WHERE dlurl = ? AND piece = ? AND done_at >= ?", (dlurl, piece, since))
+        return rows[0] if rows else None
+
+    def clear_checkpoints(self, dlurl):
+        # the whole item is done
+        self._write("DELETE FROM checkpoints WHERE dlurl = ?", (dlurl,))
+
+    # content index of the dedup store
+    def content(self, sha256, size):
+        rows = self._query("SELECT * FROM contents WHERE sha256 = ? AND size = ?", (sha256, size))
+        return rows[0] if rows else None
+
+    def record_content(self, sha256, size, local_path):
+        self._write(
+            "INSERT OR REPLACE INTO contents (sha256, size, local_path, created_at) VALUES (?, ?, ?, ?)",
+            (sha256, size, local_path, time.time()),
+        )
+
+    # page artifacts
+    def record_artifact(self, dlurl, kind, local_path):
+        size = os.path.getsize(local_path) if os.path.isfile(local_path) else None
+        self._write(
+            "INSERT OR REPLACE INTO artifacts (local_path, dlurl, kind, size, created_at) VALUES (?, ?, ?, ?, ?)",
+            (local_path, dlurl, kind, size, time.time()),
+        )
+
+    def artifacts(self, dlurl, kind):
+        return self._query("SELECT * FROM artifacts WHERE dlurl = ? AND kind = ? ORDER BY created_at", (dlurl, kind))
+
+    def all_artifacts(self):
+        return self._query("SELECT * FROM artifacts ORDER BY local_path")
+
+    def has_artifact(self, dlurl, kind):
+        # None if nothing was recorded for this item yet (downloads made before the manifest existed)
+        rows = self.artifacts(dlurl, kind)
+        if not rows:
+            return None
+        return any(os.path.isfile(row["local_path"]) for row in rows)
@@ -0,0 +1,102 @@
+# parsing of the itch.io pages: only the elements used by the downloader are built, with lxml when it is installed
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+def _classes(attrs):
+    classes = attrs.get("class") or ""
+    if isinstance(classes, str):
+        classes = classes.split()
+    return classes
+
+class TagStrainer(SoupStrainer):
+    """
+    SoupStrainer keeping the top level tags accepted by wanted(name, attrs), with everything inside them
+    @params:
+        wanted      - Required  : function called with the tag name and a dict of its attributes (Function)
+    """
+
+    def __init__(self, wanted):
+        super().__init__()
+        self.wanted = wanted
+
+    def _accepts(self, name, attrs):
+        if not hasattr(attrs, "get"):
+            attrs = dict(attrs or ())
+        return self.wanted(name, attrs)
+
+    # beautifulsoup 4.13 and later
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return self._accepts(name, attrs or {})
+
+    def allow_string_creation(self, string):
+        return False
+
+    # beautifulsoup up to 4.12
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        if hasattr(markup_name, "name"):
+            markup_attrs = markup_name.attrs
+            found = markup_name
+            markup_name = markup_name.name
+        else:
+            found = markup_name
+        if self._accepts(markup_name, markup_attrs):
+            return found
+        return None
+
+def _item_page_tag(name, attrs):
+    # csrf token, upload list, download buttons and embedded videos
+    if name == "meta":
+        return attrs.get("name") == "csrf_token"
+    if name == "div":
+        return "upload_list_widget" in _classes(attrs)
+    if name == "a":
+        return "/download/" in (attrs.get("href") or "")
+    return name == "iframe"
+
+def _purchases_page_tag(name, attrs):
+    return name == "div" and ("game_cell_data" in _classes(attrs) or "next_page" in _classes(attrs))
+
+def _iframe_tag(name, attrs):
+    return name == "iframe"
+
+ITEM_PAGE = TagStrainer(_item_page_tag)
+PURCHASES_PAGE = TagStrainer(_purchases_page_tag)
+IFRAMES = TagStrainer(_iframe_tag)
+
+def parse_item_page(html):
+    """
+    Download page of an item
+    returns a dict with:
+        csrf_token      - token posted with the old style download requests (Str or None)
+        uploads         - the "upload" elements of the upload list (list of Tag)
+        download_links  - href of the buttons pointing to a /download/ url (list of Str)
+        iframes         - src of the embedded iframes (list of Str)
+    """
+    soup = BeautifulSoup(html, PARSER, parse_only=ITEM_PAGE)
+    token = soup.find("meta", attrs={"name": "csrf_token"})
+    widget = soup.find("div", class_="upload_list_widget")
+    return {
+        "csrf_token": token["value"] if token is not None else None,
+        "uploads": widget.find_all(class_="upload") if widget is not None else [],
+        "download_links": [a["href"] for a in soup.find_all("a", class_="button", href=lambda h: h and "/download/" in h)],
+        "iframes": [iframe["src"] for iframe in soup.find_all("iframe") if iframe.get("src")],
+    }
+
+def parse_purchases_page(html):
+    # returns a list of (title, url) of a my-purchases page and true if there is a next page
+    soup = BeautifulSoup(html, PARSER, parse_only=PURCHASES_PAGE)
+    items = []
+    for game in soup.find_all("div", class_="game_cell_data"):
+        items.append((game.find("a", class_="title game_link").text, game.find("a", class_="button")["href"]))
+    return items, soup.find("div", attrs={"class": "next_page forward_link"}) is not None
+
+def parse_iframes(html):
+    # src of the iframes of a product page (embedded videos)
+    soup = BeautifulSoup(html, PARSER, parse_only=IFRAMES)
+    return [iframe["src"] for iframe in soup.find_all("iframe") if iframe.get("src")]
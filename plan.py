@@ -0,0 +1,92 @@
+# dry run: bytes a sync would fetch, skip and download again as a new version, from the remote metadata of every upload
+
+import os
+import threading
+
+import dltool
+import events
+import httpdate
+
+# what the next run does with an upload
+FETCH = "fetch"
+REVERSION = "new version"
+SKIP = "up to date"
+UNKNOWN = "unknown"
+
+def local_action(path, size, last_modified, known=None):
+    """
+    What a download of the remote file would do with the local one
+    @params:
+        path            - Required  : local file the upload is downloaded to (Str)
+        size            - Required  : remote size in bytes (Int)
+        last_modified   - Required  : remote Last-Modified header (Str)
+        known           - Optional  : manifest row of the upload, if it was downloaded before
+    returns SKIP if the local file is identical (same size and time), REVERSION if an older version is replaced, FETCH otherwise
+    """
+    if os.path.isfile(path):
+        stats = os.stat(path)
+        try:
+            same_time = last_modified and int(httpdate.timestamp(last_modified)) == int(stats.st_mtime)
+        except (TypeError, ValueError, AttributeError):
+            same_time = False
+        if same_time and stats.st_size == size:
+            return SKIP
+        return REVERSION
+    if known is not None and (known["size"] != size or known["last_modified"] != last_modified):
+        return REVERSION
+    return FETCH
+
+def bytes_to_fetch(action, size, path, headers):
+    # the part of an interrupted download that can be continued is not fetched again
+    if action == SKIP or size is None:
+        return 0
+    return size - dltool.resumable_size(path + ".incomplete", headers)
+
+class SyncPlan:
+    """
+    Totals of the planned uploads, filled in from the planning threads
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {action: [0, 0] for action in (FETCH, REVERSION, SKIP, UNKNOWN)}
+        self.transfer = 0
+        self.items = 0
+        self.recent = 0
+
+    def add_item(self, title, uploads):
+        """
+        Adds and prints the uploads of an item
+        @params:
+            title       - Required  : item title (Str)
+            uploads     - Required  : dicts with action, size, transfer and path of each upload (List)
+        """
+        counts = {}
+        transfer = 0
+        with self._lock:
+            self.items = self.items + 1
+            for upload in uploads:
+                counts[upload["action"]] = counts.get(upload["action"], 0) + 1
+                self.totals[upload["action"]][0] += 1
+                self.totals[upload["action"]][1] += upload["size"] or 0
+                transfer = transfer + upload["transfer"]
+            self.transfer = self.transfer + transfer
+        parts = [f"{counts[action]} {action}" for action in (FETCH, REVERSION, SKIP, UNKNOWN) if action in counts]
+        events.info("Plan: {}: {} MB to download ({})".format(
+            title, round(transfer/1024/1024,1), ", ".join(parts) or "no uploads"))
+        for upload in uploads:
+            if upload["action"] == UNKNOWN:
+                events.warning(f"Plan: size unknown, {upload['path']}")
+
+    def add_recent(self):
+        # item synced recently, the run skips it without looking at its uploads
+        with self._lock:
+            self.recent = self.recent + 1
+
+    def print_totals(self):
+        print("")
+        events.info("Plan for {} items ({} more synced recently):".format(self.items, self.recent))
+        for action in (FETCH, REVERSION, SKIP, UNKNOWN):
+            count, size = self.totals[action]
+            events.info("  {}: {} files, {} MB".format(action, count, round(size/1024/1024,1)))
+        events.info("Total to download: {} MB".format(round(self.transfer/1024/1024,1)))
@@ -0,0 +1,123 @@
+# stage timers and the --profile report: time per stage of a run (listing, item pages, download JSON, transfers,
+# browser, screenshots, PDF, videos) plus a cProfile dump of all the threads. disabled, a stage costs one check
+
+import contextlib
+import cProfile
+import math
+import pstats
+import sys
+import threading
+import time
+
+# stages in the order of a run, for the report
+STAGES = (
+    "listing_page", "item_page", "item_parse", "download_json", "cdn_head", "cdn_transfer", "item",
+    "chrome_start", "page_load", "wait_images", "screenshot", "screenshot_stitch", "pdf_print", "ytdlp",
+)
+
+_NULL = contextlib.nullcontext()
+
+class Profiler:
+    """
+    Durations of the stages of a run, and a cProfile of every thread while it is enabled
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._durations = {}
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._started = None
+
+    def enable(self, cprofile=True):
+        self.enabled = True
+        self._started = time.monotonic()
+        if not cprofile:
+            return
+        if sys.version_info >= (3, 12):
+            # one profiler sees every thread
+            profile = cProfile.Profile()
+            self._profiles.append(profile)
+            profile.enable()
+        else:
+            # one profiler per thread, threads started from now on get theirs on their first call
+            threading.setprofile(self._profile_thread)
+            self._profile_thread()
+
+    def _profile_thread(self, *args):
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def disable(self):
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        for profile in self._profiles:
+            profile.disable()
+        self.enabled = False
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._durations.setdefault(name, []).append(seconds)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        starttime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - starttime)
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL
+        return self._timed(name)
+
+    def dump(self, path):
+        # cProfile statistics of all the threads in one file, for pstats or snakeviz
+        stats = None
+        for profile in self._profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # a thread that did not run any profiled call
+                pass
+        if stats is not None:
+            stats.dump_stats(path)
+        return stats is not None
+
+    def table(self):
+        # rows of (stage, count, total, mean, p95) in seconds
+        rows = []
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self._durations.items()}
+        names = [name for name in STAGES if name in durations] + sorted(name for name in durations if name not in STAGES)
+        for name in names:
+            values = durations[name]
+            p95 = values[min(len(values) - 1, math.ceil(len(values) * 0.95) - 1)]
+            rows.append((name, len(values), sum(values), sum(values) / len(values), p95))
+        return rows
+
+    def report(self):
+        # stages run in parallel threads, their totals can add up to more than the run
+        lines = ["{:<20} {:>7} {:>10} {:>9} {:>9}".format("stage", "count", "total s", "mean s", "p95 s")]
+        for name, count, total, mean, p95 in self.table():
+            lines.append("{:<20} {:>7} {:>10.2f} {:>9.3f} {:>9.3f}".format(name, count, total, mean, p95))
+        if self._started is not None:
+            lines.append("{:<20} {:>7} {:>10.2f}".format("run (wall clock)", "", time.monotonic() - self._started))
+        return "\n".join(lines)
+
+# shared by all the modules of the process, enabled by --profile
+profiler = Profiler()
+
+def stage(name):
+    """
+    Context manager timing a stage of the run, does nothing unless the profiler is enabled
+    @params:
+        name        - Required  : stage name, see STAGES (Str)
+    """
+    return profiler.stage(name)
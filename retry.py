@@ -0,0 +1,203 @@
+# retries with exponential backoff, Retry-After handling and per host request rate limits, shared by all requests
+
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+import events
+
+# answers worth asking again for, the others will not change by waiting
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class GaveUp(Exception):
+    """
+    Raised by RetryPolicy.run() when every attempt failed, the item is retried in a later pass
+    @params:
+        what        - Required  : what was being done (Str)
+        error       - Required  : exception of the last attempt
+    """
+
+    def __init__(self, what, error):
+        super().__init__(f"{what}: {error}")
+        self.what = what
+        self.error = error
+
+class TokenBucket:
+    """
+    Thread safe token bucket: take(n) waits until n tokens are available
+    @params:
+        rate        - Required  : tokens added per second, 0 = unlimited (Float)
+        burst       - Optional  : tokens that can be saved up, default is one second worth of tokens (Float)
+    """
+
+    def __init__(self, rate, burst=None):
+        self._lock = threading.Lock()
+        self.set_rate(rate, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self.rate = float(rate)
+            self.burst = float(burst if burst is not None else max(1.0, self.rate))
+
+    def take(self, amount=1):
+        # returns the seconds waited
+        waited = 0.0
+        while True:
+            with self._lock:
+                if self.rate <= 0:
+                    return waited
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # more than the burst at once is allowed, it leaves the bucket in debt
+                if self._tokens >= min(amount, self.burst):
+                    self._tokens = self._tokens - amount
+                    return waited
+                delay = (min(amount, self.burst) - self._tokens) / self.rate
+            time.sleep(delay)
+            waited = waited + delay
+
+class HostRateLimiter:
+    """
+    One TokenBucket per host
+    @params:
+        rate        - Required  : requests per second and host, 0 = unlimited (Float)
+        burst       - Optional  : requests a host gets at once after a pause (Float)
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, url):
+        if self.rate <= 0:
+            return 0.0
+        host = url.split("/")[2].lower() if url.count("/") >= 2 else ""
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return bucket.take()
+
+def retry_after_seconds(response):
+    # Retry-After of a response in seconds (either form of the header), None if there is none
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+def already_retried(error):
+    # true if the request that failed was retried by a RetrySession already, asking again would multiply its attempts
+    response = getattr(error, "response", None)
+    return getattr(error, "retried", False) or getattr(response, "retried", False)
+
+class RetryPolicy:
+    """
+    How often and how long to wait before something is tried again
+    @params:
+        attempts        - Optional  : tries in total (Int)
+        base            - Optional  : backoff of the first retry in seconds, doubled for each one after it (Float)
+        cap             - Optional  : longest backoff in seconds (Float)
+        max_retry_after - Optional  : longest wait asked by a Retry-After header that is honoured (Float)
+    """
+
+    def __init__(self, attempts=5, base=2.0, cap=120.0, max_retry_after=600.0):
+        self.attempts = max(1, int(attempts))
+        self.base = float(base)
+        self.cap = float(cap)
+        self.max_retry_after = float(max_retry_after)
+
+    def delay(self, attempt, response=None):
+        # seconds to wait after the failed attempt number attempt (0 based), "full jitter" spreads the retries out
+        asked = retry_after_seconds(response)
+        if asked is not None:
+            return min(asked, self.max_retry_after)
+        return random.uniform(0, min(self.cap, self.base * (2 ** attempt)))
+
+    def run(self, fn, what=""):
+        # fn(attempt) is called until it returns without an exception, GaveUp is raised after the last attempt.
+        # each request is retried at one layer only: a failure the RetrySession already retried is not tried again,
+        # fn is for what the session cannot retry (expired urls, transfers cut off, incomplete files)
+        for attempt in range(self.attempts):
+            try:
+                return fn(attempt)
+            except GaveUp:
+                raise
+            except Exception as error:
+                if attempt + 1 >= self.attempts or already_retried(error):
+                    raise GaveUp(what, error) from error
+                delay = self.delay(attempt, getattr(error, "response", None))
+                events.warning(f"{what} failed ({error}). Retry {attempt + 1} of {self.attempts - 1} in {round(delay, 1)} s",
+                               event="retry", what=what, error=str(error), attempt=attempt + 1, delay=round(delay, 3))
+                time.sleep(delay)
+
+class RetrySession(requests.Session):
+    """
+    requests.Session waiting for the rate limit of the host before each request and retrying
+    connection errors and 429/5xx answers with backoff, honouring Retry-After. The error or answer it gives up on
+    is marked as retried, RetryPolicy.run() does not try it again
+    @params:
+        policy      - Optional  : RetryPolicy
+        limiter     - Optional  : HostRateLimiter
+        timeout     - Optional  : (connect, read) seconds of the requests that set none, None = wait forever (Tuple)
+    """
+
+    def __init__(self, policy=None, limiter=None, timeout=None):
+        super().__init__()
+        self.policy = policy or RetryPolicy()
+        self.limiter = limiter
+        self.timeout = timeout
+
+    def request(self, method, url, *args, **kwargs):
+        # a stalled server raises Timeout and is retried. a stalled transfer raises ConnectionError while the body
+        # is read, after the request returned, and is retried by the RetryPolicy around the download
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            waited = 0.0
+            if self.limiter is not None:
+                waited = self.limiter.take(url)
+            starttime = time.monotonic()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                events.emit("http_request", "DEBUG", method=method, url=url.split("?")[0], error=type(error).__name__,
+                            seconds=round(time.monotonic() - starttime, 3), rate_limit_wait=round(waited, 3), attempt=attempt)
+                if attempt + 1 >= self.policy.attempts:
+                    error.retried = True
+                    raise
+                delay = self.policy.delay(attempt)
+                reason = type(error).__name__
+            else:
+                # time until the response headers, the body of a streamed download is not included
+                events.emit("http_request", "DEBUG", method=method, url=url.split("?")[0], status=response.status_code,
+                            seconds=round(time.monotonic() - starttime, 3), rate_limit_wait=round(waited, 3), attempt=attempt)
+                if response.status_code not in RETRY_STATUS:
+                    return response
+                if attempt + 1 >= self.policy.attempts:
+                    response.retried = True
+                    return response
+                delay = self.policy.delay(attempt, response)
+                reason = f"HTTP {response.status_code}"
+                response.close()
+            events.warning(f"{method} {url.split('?')[0]} failed ({reason}). Retry {attempt + 1} of {self.policy.attempts - 1} in {round(delay, 1)} s",
+                           event="retry", what=f"{method} {url.split('?')[0]}", error=reason, attempt=attempt + 1, delay=round(delay, 3))
+            time.sleep(delay)
+            attempt = attempt + 1
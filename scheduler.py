@@ -0,0 +1,76 @@
+# run upload downloads on a bounded worker pool
+
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+def host_of(url):
+    # "https://w3g3a5v6.ssl.hwcdn.net/upload/..." -> "w3g3a5v6.ssl.hwcdn.net"
+    parts = url.split("/")
+    if len(parts) > 2:
+        return parts[2].lower()
+    return ""
+
+class DownloadScheduler:
+    """
+    Thread pool that runs uploads of several items at the same time
+    @params:
+        workers     - Optional  : number of uploads downloaded in parallel (Int)
+        per_host    - Optional  : maximum parallel connections against a single host, segments included (Int)
+        max_pending - Optional  : submitted uploads allowed to wait for a worker before submit() blocks (Int)
+    """
+
+    def __init__(self, workers=4, per_host=2, max_pending=None):
+        self.workers = max(1, int(workers))
+        self.per_host = max(1, int(per_host))
+        if max_pending is None:
+            max_pending = self.workers * 4
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download")
+        self._pending = threading.BoundedSemaphore(max(self.workers, int(max_pending)))
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        # blocks while too many uploads are queued, so the item pages are not parsed too far ahead
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda f: self._pending.release())
+        return future
+
+    def _slot(self, url):
+        host = host_of(url)
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host)
+                self._host_slots[host] = slot
+        return slot
+
+    @contextmanager
+    def host_slot(self, url):
+        # limits the number of parallel connections against the host of url (hwcdn, cloudflare mirror, ...),
+        # a transfer holds one slot for its first connection
+        with self._slot(url):
+            yield
+
+    @contextmanager
+    def extra_slots(self, url, wanted):
+        # more connections for a transfer already holding a slot (segmented downloads), yields how many it got.
+        # only the slots free right now are taken, waiting for more could deadlock two transfers holding one each
+        slot = self._slot(url)
+        taken = 0
+        while taken < wanted and slot.acquire(blocking=False):
+            taken = taken + 1
+        try:
+            yield taken
+        finally:
+            for _ in range(taken):
+                slot.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,247 @@
+# several workers (processes or machines) sharing one download directory: each takes a stable slice of the purchases,
+# holds a lease file on the game directory it is writing and records its progress in the shared manifest
+
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+import events
+
+def parse_shard(value):
+    """
+    Parses a --shard value
+    @params:
+        value       - Required  : "I/N", worker I of N, counted from 1 (Str)
+    returns (index, count), raises ValueError if the value is not valid
+    """
+    index, _, count = value.partition("/")
+    index, count = int(index), int(count)
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError("shard must be I/N with 1 <= I <= N, e.g. 1/3")
+    return index, count
+
+def shard_of(gamedirectory, count):
+    # the same on every machine and Python version, unlike hash()
+    return int.from_bytes(hashlib.sha1(gamedirectory.encode("utf-8")).digest()[:8], "big") % count + 1
+
+def in_shard(g, shard):
+    """
+    True if the item belongs to the shard
+    @params:
+        g           - Required  : purchase, with its dlurl (Dict)
+        shard       - Required  : (index, count) of parse_shard, None = every item belongs to it
+    """
+    if shard is None:
+        return True
+    return shard_of(g["dlurl"].split("/")[3], shard[1]) == shard[0]
+
+def shard_label(shard):
+    return "all" if shard is None else "{}/{}".format(*shard)
+
+def process_alive(pid):
+    # true if a process with this id runs on this machine
+    if os.name == "nt":
+        # os.kill would stop it on Windows
+        import ctypes
+
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        try:
+            code = ctypes.c_ulong()
+            ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            ctypes.windll.kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # e.g. running as another user
+        return True
+    return True
+
+class LeaseDirectory:
+    """
+    Lease files of the game directories being written, so two workers never write the same one. A lease expires
+    when its worker stops renewing it, e.g. after a crash, and is then taken over by the next worker asking for it.
+    The lease of a worker of the same machine which is not running any more is taken over right away
+    @params:
+        path        - Required  : directory of the lease files, in the shared download directory (Str)
+        ttl         - Optional  : seconds a lease is valid without being renewed, the worker clocks must agree within it (Int)
+    """
+
+    def __init__(self, path, ttl=600):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.owner = "{}:{}:{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        # names held by this process, with the number of items holding each
+        self._held = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stale(self, lease):
+        # expired, or left by a worker of this machine that is not running any more (no need to wait for the expiry then)
+        if lease["expires"] <= time.time():
+            return True
+        host, _, rest = (lease["owner"] or "").partition(":")
+        pid = rest.partition(":")[0]
+        return host == socket.gethostname() and pid.isdigit() and int(pid) != os.getpid() and not process_alive(int(pid))
+
+    def _file(self, name):
+        return os.path.join(self.path, name + ".lease")
+
+    def _record(self):
+        return json.dumps({"owner": self.owner, "expires": time.time() + self.ttl})
+
+    def _read(self, path):
+        # owner and expiry of a lease, a file still being written by its creator counts from its modification time
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            try:
+                return {"owner": None, "expires": os.path.getmtime(path) + self.ttl}
+            except OSError:
+                return None
+
+    def _replace(self, path):
+        temp = "{}.{}.tmp".format(path, uuid.uuid4().hex[:8])
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write(self._record())
+        os.replace(temp, path)
+
+    def acquire(self, name):
+        """
+        Takes the lease of name, returns False if another worker holds it. Items of this process may hold the same
+        name together, the lease is only given back by the last one
+        @params:
+            name        - Required  : game directory (Str)
+        """
+        with self._lock:
+            if name in self._held:
+                self._held[name] = self._held[name] + 1
+                return True
+        path = self._file(name)
+        try:
+            # created only if there is no lease yet, atomically
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self._record())
+        except FileExistsError:
+            current = self._read(path)
+            if current is not None and current["owner"] != self.owner and not self._stale(current):
+                return False
+            # lease of a worker that stopped. of two workers taking it over at once the last one wins,
+            # the other one sees it after a moment and leaves the item
+            events.debug("Taking over the lease of {} from a stopped worker".format(name), event="lease_takeover", name=name,
+                         previous=current["owner"] if current else None)
+            self._replace(path)
+            time.sleep(0.2)
+            current = self._read(path)
+            if current is None or current["owner"] != self.owner:
+                return False
+        with self._lock:
+            self._held[name] = self._held.get(name, 0) + 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._renew, name="lease-renewal", daemon=True)
+                self._thread.start()
+        return True
+
+    def release(self, name):
+        with self._lock:
+            if name not in self._held:
+                return
+            self._held[name] = self._held[name] - 1
+            if self._held[name] > 0:
+                return
+            del self._held[name]
+        path = self._file(name)
+        current = self._read(path)
+        if current is not None and current["owner"] == self.owner:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _renew(self):
+        # the held leases are written again well before they expire
+        while not self._stop.wait(max(1, self.ttl / 3)):
+            with self._lock:
+                held = list(self._held)
+            for name in held:
+                current = self._read(self._file(name))
+                if current is None or current["owner"] != self.owner:
+                    events.warning("Lease of {} lost to another worker".format(name), event="lease_lost", name=name)
+                    with self._lock:
+                        self._held.pop(name, None)
+                    continue
+                self._replace(self._file(name))
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self._held = dict.fromkeys(self._held, 1)
+            held = list(self._held)
+        for name in held:
+            self.release(name)
+
+# counters of a worker, in the order they are shown
+COUNTS = ("items", "synced", "recent", "leased", "failed")
+
+class Progress:
+    """
+    Item counters of a worker, kept in the shared manifest so the progress of all the workers can be shown together
+    @params:
+        manifest    - Required  : manifest.Manifest
+        worker      - Required  : shard label of the worker (Str)
+        interval    - Optional  : seconds between two writes of the counters (Float)
+    """
+
+    def __init__(self, manifest, worker, interval=5):
+        self.manifest = manifest
+        self.worker = worker
+        self.interval = interval
+        self.counts = dict.fromkeys(COUNTS, 0)
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._saved = 0
+
+    def add(self, key, count=1):
+        with self._lock:
+            self.counts[key] = self.counts[key] + count
+            due = time.monotonic() - self._saved >= self.interval
+        if due:
+            self.save()
+
+    def save(self, finished=False):
+        with self._lock:
+            self._saved = time.monotonic()
+            record = dict(self.counts, host=socket.gethostname(), pid=os.getpid(), started=self.started, updated=time.time(), finished=finished)
+        self.manifest.set_state("progress:" + self.worker, json.dumps(record))
+
+def combined_progress(manifest):
+    """
+    Progress of every worker that recorded one, and the totals
+    returns (rows, totals): rows are (worker, counters) sorted by worker, totals adds up the counters of COUNTS
+    """
+    rows = []
+    for key, value in manifest.states("progress:"):
+        try:
+            rows.append((key[len("progress:"):], json.loads(value)))
+        except ValueError:
+            pass
+    rows.sort()
+    totals = {name: sum(record.get(name, 0) for _, record in rows) for name in COUNTS}
+    return rows, totals
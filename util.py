@@ -5,25 +5,111 @@ References
     selenium_wait_for_images_loaded.py: https://gist.github.com/munro/7f81bd1657499866f7c2
 """
 
+import contextlib
+import io
+import json
 import os
+import struct
 import time
+import zlib
 
 from PIL import Image
 Image.MAX_IMAGE_PIXELS = None
 from textwrap import dedent
-from datetime import datetime
 
-def fullpage_screenshot(driver, file, debugon=False):
+import atomicfile
+import events
+import profiling
+
+SETTLE_SCRIPT = "window.scrollTo({0}, {1});" \
+    "var pending = Array.prototype.filter.call(document.images, function (img) {{ return !img.complete; }}).length;" \
+    "return [document.body.scrollHeight, window.scrollX, window.scrollY, pending];"
+
+def wait_until_settled(driver, x, y, timeout=10, interval=0.1, stable=2):
+    """
+    Scrolls to (x, y) and returns as soon as the page height, the scroll position and the number
+    of images still loading did not change for stable polls in a row (and no image is loading)
+    @params:
+        timeout     - Optional  : seconds after which the tile is taken anyway (Float)
+        interval    - Optional  : seconds between two polls (Float)
+        stable      - Optional  : identical polls needed (Int)
+    """
+    deadline = time.monotonic() + timeout
+    last = driver.execute_script(SETTLE_SCRIPT.format(x, y))
+    same = 0
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        current = driver.execute_script(SETTLE_SCRIPT.format(x, y))
+        if current == last and current[3] == 0:
+            same = same + 1
+            if same >= stable:
+                return True
+        else:
+            same = 0
+        last = current
+    return False
+
+class StreamingPNG:
+    """
+    RGB PNG written row by row, only the compressor state is kept in memory
+    @params:
+        file        - Required  : path of the png (Str)
+        width       - Required  : image width (Int)
+        height      - Required  : image height (Int)
+    """
+
+    def __init__(self, file, width, height):
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self._file = open(file, "wb")
+        self._compressor = zlib.compressobj(6)
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    def write_image(self, image):
+        # appends the rows of an RGB image of the same width
+        data = image.convert("RGB").tobytes()
+        stride = self.width * 3
+        out = []
+        for row in range(image.height):
+            out.append(self._compressor.compress(b"\x00" + data[row * stride:(row + 1) * stride]))
+        self.rows = self.rows + image.height
+        out = b"".join(out)
+        if out:
+            self._chunk(b"IDAT", out)
+
+    def close(self):
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+        self._file.close()
+
+    def abort(self):
+        # closes the file of an image that will not be finished
+        self._file.close()
+
+def fullpage_screenshot(driver, file, debugon=False, mode="stream"):
+        """
+        Screenshot of the whole page, taken one viewport at a time
+        @params:
+            mode        - Optional  : stream = one png written one strip at a time (memory of about one viewport),
+                                      tiles  = numbered png strips next to file plus a .json index, file is the index,
+                                      single = whole page stitched in memory (Str)
+        returns the path of the written file
+        """
 
         if debugon: 
-            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + "Starting chrome full page screenshot workaround ...")
+            events.debug("Starting chrome full page screenshot workaround ...")
 
         total_width = driver.execute_script("return document.body.offsetWidth")
         total_height = driver.execute_script("return document.body.parentNode.scrollHeight")
         viewport_width = driver.execute_script("return document.body.clientWidth")
         viewport_height = driver.execute_script("return window.innerHeight")
         if debugon: 
-            print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + "Total: ({0}, {1}), Viewport: ({2},{3})".format(total_width, total_height,viewport_width,viewport_height))
+            events.debug("Total: ({0}, {1}), Viewport: ({2},{3})".format(total_width, total_height,viewport_width,viewport_height))
         rectangles = []
 
         i = 0
@@ -41,7 +127,7 @@ def fullpage_screenshot(driver, file, debugon=False):
                     top_width = total_width
 
                 if debugon: 
-                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + "Appending rectangle ({0},{1},{2},{3})".format(ii, i, top_width, top_height))
+                    events.debug("Appending rectangle ({0},{1},{2},{3})".format(ii, i, top_width, top_height))
         
                 rectangles.append((ii, i, top_width,top_height))
 
@@ -49,52 +135,98 @@ def fullpage_screenshot(driver, file, debugon=False):
 
             i = i + viewport_height
 
-        stitched_image = Image.new('RGB', (total_width, total_height))
+        if mode == "single":
+            stitched_image = Image.new('RGB', (total_width, total_height))
+        elif mode == "tiles":
+            file = os.path.splitext(file)[0] + ".json"
+            index = {"width": total_width, "height": total_height, "tiles": []}
+        else:
+            # written next to the final name, which it replaces once complete
+            writer = StreamingPNG(file + atomicfile.TEMP_SUFFIX, total_width, total_height)
+
+        # strips of one viewport height, written out as soon as all the tiles of the strip are taken
+        strip = None
+        strip_top = 0
         previous = None
         part = 0
 
-        for rectangle in rectangles:
-            if not previous is None:
-                lenOfPage = driver.execute_script("window.scrollTo({0}, {1})".format(rectangle[0], rectangle[1])+";var lenOfPage=document.body.scrollHeight;return lenOfPage;")
-                match=False
-                while(match==False):
-                    lastCount = lenOfPage
-                    time.sleep(3)
-                    lenOfPage = driver.execute_script("window.scrollTo({0}, {1})".format(rectangle[0], rectangle[1])+";var lenOfPage=document.body.scrollHeight;return lenOfPage;")
-                    if lastCount==lenOfPage:
-                        match=True
-                     
+        finished = False
+        try:
+            for rectangle in rectangles:
+                if mode != "single" and (strip is None or rectangle[1] != strip_top):
+                    if strip is not None:
+                        with profiling.stage("screenshot_stitch"):
+                            write_strip(mode, strip, strip_top, file, writer if mode == "stream" else index, debugon)
+                    strip_top = rectangle[1]
+                    strip = Image.new('RGB', (total_width, rectangle[3] - rectangle[1]))
+
+                if not previous is None:
+                    settled = wait_until_settled(driver, rectangle[0], rectangle[1])
+                    if debugon: 
+                        events.debug("Scrolled To ({0},{1}){2}".format(rectangle[0], rectangle[1], "" if settled else ", page still changing"))
+
                 if debugon: 
-                    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + "Scrolled To ({0},{1})".format(rectangle[0], rectangle[1]))
-        
-                time.sleep(0.2)
+                    events.debug("Capturing part {0} ...".format(part))
+
+                # tiles stay in memory, nothing is written next to the working directory
+                screenshot = Image.open(io.BytesIO(driver.get_screenshot_as_png()))
 
-            file_name = "part_{0}.png".format(part)
-            if debugon: 
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + "Capturing {0} ...".format(file_name))
+                if rectangle[1] + viewport_height > total_height:
+                    offset = (rectangle[0], total_height - viewport_height)
+                else:
+                    offset = (rectangle[0], rectangle[1])
 
-            driver.get_screenshot_as_file(file_name)
-            screenshot = Image.open(file_name)
+                if debugon: 
+                    events.debug("Adding to stitched image with offset ({0}, {1})".format(offset[0],offset[1]))
+                with profiling.stage("screenshot_stitch"):
+                    if mode == "single":
+                        stitched_image.paste(screenshot, offset)
+                    else:
+                        # the last strip is shorter, the browser stops scrolling at the bottom of the page
+                        strip.paste(screenshot, (offset[0], offset[1] - strip_top))
 
-            if rectangle[1] + viewport_height > total_height:
-                offset = (rectangle[0], total_height - viewport_height)
-            else:
-                offset = (rectangle[0], rectangle[1])
+                del screenshot
+                part = part + 1
+                previous = rectangle
 
-            if debugon: 
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + "Adding to stitched image with offset ({0}, {1})".format(offset[0],offset[1]))
-            stitched_image.paste(screenshot, offset)
+            with profiling.stage("screenshot_stitch"):
+                if mode == "single":
+                    stitched_image.save(file + atomicfile.TEMP_SUFFIX, format="PNG")
+                    atomicfile.replace(file + atomicfile.TEMP_SUFFIX, file)
+                elif strip is not None:
+                    write_strip(mode, strip, strip_top, file, writer if mode == "stream" else index, debugon)
 
-            del screenshot
-            os.remove(file_name)
-            part = part + 1
-            previous = rectangle
+            if mode == "stream":
+                writer.close()
+                atomicfile.replace(file + atomicfile.TEMP_SUFFIX, file)
+            elif mode == "tiles":
+                # the index is written last, the tiles are only used once it exists
+                with atomicfile.writer(file, "w", encoding="utf-8") as f:
+                    json.dump(index, f, indent=1)
+            finished = True
+        finally:
+            if not finished and mode in ("stream", "single"):
+                # an interrupted capture leaves neither an open file nor a partial png behind
+                if mode == "stream":
+                    writer.abort()
+                with contextlib.suppress(OSError):
+                    os.remove(file + atomicfile.TEMP_SUFFIX)
 
-        stitched_image.save(file)
         if debugon: 
-                print(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + "[DEBUG] " + "Finishing chrome full page screenshot workaround ...")
+                events.debug("Finishing chrome full page screenshot workaround ...")
             
-        return True
+        return file
+
+def write_strip(mode, strip, top, file, target, debugon=False):
+    # a finished strip is appended to the png (stream) or saved as the next numbered tile (tiles)
+    if mode == "stream":
+        target.write_image(strip)
+    else:
+        tilename = os.path.splitext(file)[0] + "_part_{0:03d}.png".format(len(target["tiles"]) + 1)
+        strip.save(tilename)
+        target["tiles"].append({"file": os.path.basename(tilename), "x": 0, "y": top, "width": strip.width, "height": strip.height})
+    if debugon: 
+        events.debug("Strip at {0} written, height {1}".format(top, strip.height))
         
 def wait_until_images_loaded(driver, timeout=30):
     """ Waits for all images & background images to load """
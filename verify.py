@@ -0,0 +1,121 @@
+# verification of the download directory against the hashes kept in the manifest
+
+import hashlib
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import dltool
+import events
+
+# files of the download directory that are not downloads: unfinished ones, older versions, dedup temporaries
+IGNORED_SUFFIXES = (".incomplete", ".incomplete.json", ".old", ".dedup", ".tmp")
+
+def hash_worker(path, algorithms):
+    # runs in a worker process, returns ({algorithm: hexdigest}, bytes read) of a whole file
+    hashers = []
+    for name in algorithms:
+        hashers.append(hashlib.sha256() if name == "sha256" else dltool.fast_hasher(name))
+    dltool.hash_file(path, hashers=hashers, blocksize=16 * 1024 * 1024)
+    return {name: hasher.hexdigest() for name, hasher in zip(algorithms, hashers)}, os.path.getsize(path)
+
+def expected_hash(row):
+    # (algorithm, hexdigest) to check a file with, the fast hash when it was recorded and can be computed here
+    if row["fast_hash"]:
+        name, digest = row["fast_hash"].split(":", 1)
+        if dltool.fast_hasher(name) is not None:
+            return name, digest
+    if row["sha256"]:
+        return "sha256", row["sha256"]
+    return None, None
+
+def orphaned_files(download_dir, known, skip):
+    # files under download_dir that the manifest does not know about
+    found = []
+    for root, dirs, files in os.walk(download_dir):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) not in skip]
+        for name in files:
+            path = os.path.abspath(os.path.join(root, name))
+            if path in known or path in skip or name.endswith(IGNORED_SUFFIXES) or name.startswith(("itch-batch-downloader.db", "itch-batch-downloader-events")):
+                continue
+            found.append(path)
+    return sorted(found)
+
+def verify_downloads(manifest, download_dir, workers=None, fast_hash=None, debugon=False):
+    """
+    Hashes every download of the manifest again on a process pool and compares it with the recorded hash
+    @params:
+        manifest    - Required  : manifest.Manifest of download_dir
+        download_dir- Required  : download directory (Str)
+        workers     - Optional  : processes hashing files, default is the number of CPUs (Int)
+        fast_hash   - Optional  : also record this hash ("xxh3", "blake2b") for files hashed the first time (Str)
+    returns a dict with the lists ok, corrupt, missing, orphaned and hashed (files without a hash until now)
+    """
+    report = {"ok": [], "corrupt": [], "missing": [], "orphaned": [], "hashed": []}
+    known = set()
+    jobs = []
+    for row in manifest.all_uploads():
+        path = os.path.abspath(row["local_path"])
+        if path in known:
+            continue
+        known.add(path)
+        # older versions of an upload may be deleted, or were renamed to the current one
+        if not os.path.isfile(path) and row["kind"] != "old_version":
+            report["missing"].append(path)
+            continue
+        if row["size"] is not None and os.path.getsize(path) != row["size"]:
+            report["corrupt"].append(path)
+            continue
+        name, digest = expected_hash(row)
+        if name is None:
+            algorithms = ["sha256"] + ([fast_hash] if dltool.fast_hasher(fast_hash) is not None else [])
+        else:
+            algorithms = [name]
+        jobs.append((path, row, algorithms, digest))
+    for row in manifest.all_artifacts():
+        path = os.path.abspath(row["local_path"])
+        known.add(path)
+        if not os.path.isfile(path):
+            report["missing"].append(path)
+
+    skip = set([os.path.abspath(os.path.join(download_dir, name)) for name in (".dedup", ".leases")])
+    report["orphaned"] = orphaned_files(download_dir, known, skip)
+
+    # largest files first, so a big one does not start last and hold up the end
+    jobs.sort(key=lambda job: -os.path.getsize(job[0]))
+    events.info(f"Verifying {len(jobs)} files")
+    totalbytes = 0
+    starttime = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(hash_worker, path, algorithms): (path, row, algorithms, digest) for path, row, algorithms, digest in jobs}
+        for future in as_completed(futures):
+            path, row, algorithms, digest = futures[future]
+            try:
+                digests, size = future.result()
+            except OSError:
+                report["missing"].append(path)
+                continue
+            totalbytes = totalbytes + size
+            if digest is None:
+                fast = f"{algorithms[1]}:{digests[algorithms[1]]}" if len(algorithms) > 1 else None
+                manifest.set_upload_hashes(row["upload_key"], digests["sha256"], fast)
+                report["hashed"].append(path)
+            elif digests[algorithms[0]] == digest:
+                report["ok"].append(path)
+            else:
+                report["corrupt"].append(path)
+            if debugon:
+                events.debug(f"Verified {path}")
+    difftime = max(time.time() - starttime, 0.001)
+
+    for path in sorted(report["corrupt"]):
+        events.error(f"Corrupt: {path}")
+    for path in sorted(report["missing"]):
+        events.error(f"Missing: {path}")
+    for path in report["orphaned"]:
+        events.warning(f"Not in the manifest: {path}")
+    events.info("Verification done: {} ok, {} hashed for the first time, {} corrupt, {} missing, {} not in the manifest".format(
+        len(report["ok"]), len(report["hashed"]), len(report["corrupt"]), len(report["missing"]), len(report["orphaned"])))
+    events.info("{} MB read in {} s ({} MB/s, {} files/s)".format(
+        round(totalbytes/1024/1024,1), round(difftime,2), round(totalbytes/1024/1024/difftime,1), round(len(jobs)/difftime,1)))
+    return report